@@ -0,0 +1,231 @@
+# author: Ioana David
+# runs the graphing pipeline without Qt, a browser or any prompts, eg. as a nightly job on an analysis server
+# usage: python batch_graphing.py --config batch.json
+#        python batch_graphing.py --master-directory /data/hplc --since 2020-03-01 --target 254 1.234 0.05 --output out
+#
+# a config file holds the same settings as the arguments (the arguments win when both are given), eg.
+#     {"master_directory": "/data/hplc", "experiments": ["2020-03-13 10-00-00", "2020-03-14"],
+#      "targets": [[254, 1.234, 0.05], [210, 3.455, 0.1]], "output": "/data/hplc/graphs", "format": "parquet",
+#      "figures": "html", "jobs": 4, "calibration": true}
+
+import argparse
+import json
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import pandas as pd
+from calibration import export_summary, fit_calibrations, load_calibration_data, overlay_calibration
+from experiment_index import find_experiments
+from graph_data import GRAPH_DATA_EXTENSIONS, load_graph_data
+from interactive_graphing import MASTER_DIRECTORY, REPORT_PARSER, make_figure, write_to_csv
+
+
+SUMMARY_FILE_NAME = 'batch_summary.json'
+CALIBRATION_FILE_NAME = 'calibration_summary.csv'
+CALIBRATION_FIGURE_NAME = 'calibration.html'
+DEFAULTS = {
+    'master_directory': MASTER_DIRECTORY,
+    'experiments': None,        # "DATE" or "DATE TIME" selectors, None for every experiment
+    'since': None,
+    'until': None,
+    'targets': [],              # [signal, retention time, flex time] lists
+    'push_volumes': None,       # the folder of push_volumes.csv, the experiment folder by default
+    'output': 'batch_output',
+    'format': 'csv',
+    'figures': 'html',
+    'max_points': None,
+    'jobs': os.cpu_count() or 1,
+    'parser': REPORT_PARSER,
+    'skip_existing': False,
+    'calibration': False,       # fit the calibration line of every target of every experiment once they are written
+}
+
+
+def load_config(config_path):
+    """
+    :param config_path: the path to a JSON config file
+    :return: the settings in the file, checked against the known settings
+    """
+    with open(config_path, 'r') as config_file:
+        config = json.load(config_file)
+    unknown = set(config) - set(DEFAULTS)
+    if unknown:
+        raise ValueError(f"unknown settings in {config_path}: {sorted(unknown)}")
+    return config
+
+
+def select_experiments(master_directory, experiments=None, since=None, until=None):
+    """
+    :param master_directory: the folder that holds a folder of experiments for every date
+    :param experiments: a list of 'YYYY-MM-DD' or 'YYYY-MM-DD HH-MM-SS' selectors, or None for every experiment
+    :param since: the first date to include, 'YYYY-MM-DD', or None
+    :param until: the last date to include, 'YYYY-MM-DD', or None
+    :return: a list of (date, time, full path) of the selected experiments, sorted by date and time
+    """
+    selected = []
+    for des_date, des_time, full_path in find_experiments(master_directory):
+        if since is not None and des_date < since:
+            continue
+        if until is not None and des_date > until:
+            continue
+        if experiments is not None and des_date not in experiments and f"{des_date} {des_time}" not in experiments:
+            continue
+        selected.append((des_date, des_time, full_path))
+    return selected
+
+
+def output_name(des_date, des_time, target):
+    """
+    :return: the name (without extension) of the graph data and figure of one target of an experiment
+    """
+    signal, ret_time, flex_time = target
+    return f"{des_date}_{des_time}_{signal:g}nm_{ret_time:g}min"
+
+
+def process_experiment(des_date, des_time, full_path, settings):
+    """
+    :param des_date: the date of the experiment
+    :param des_time: the time of the experiment
+    :param full_path: the path to the experiment folder
+    :param settings: the batch settings
+    :return: a list of result dicts, one per target
+
+    :purpose: writes the graph data and the figure of every target of one experiment; the targets run one after
+              another so they share the experiment's report cache, and a failed target does not stop the others
+    """
+    results = []
+    for target in settings['targets']:
+        signal, ret_time, flex_time = target
+        name = output_name(des_date, des_time, target)
+        graph_data = os.path.join(settings['output'], name + GRAPH_DATA_EXTENSIONS[settings['format']])
+        figure = os.path.join(settings['output'], f"{name}.{settings['figures']}") if settings['figures'] != 'none' \
+            else None
+        result = {'date': des_date, 'time': des_time, 'experiment': full_path, 'signal': signal,
+                  'retention time': ret_time, 'flex time': flex_time, 'graph data': graph_data, 'figure': figure}
+        if settings['skip_existing'] and os.path.exists(graph_data) and (figure is None or os.path.exists(figure)):
+            results.append({**result, 'status': 'skipped'})
+            continue
+        start_time = time.perf_counter()
+        try:
+            write_to_csv(des_date, des_time, ret_time, flex_time, signal, settings['push_volumes'] or full_path,
+                         workers=1, manifest=False, output_format=settings['format'],
+                         master_directory=settings['master_directory'], parser=settings['parser'],
+                         graph_data=graph_data)
+            if figure is not None:
+                data = load_graph_data(graph_data)
+                fig = make_figure(data, max_points=settings['max_points'])
+                fig.update_layout(title=f"HPLC Graph: {des_date} {des_time}, {signal:g} nm, {ret_time:g} min")
+                if settings['figures'] == 'html':
+                    # plotly.js is written once next to the figures instead of into every file
+                    fig.write_html(figure, include_plotlyjs='directory')
+                else:
+                    fig.write_image(figure)         # png, svg and pdf need the kaleido package
+            result.update({'status': 'done', 'rows': len(load_graph_data(graph_data))})
+        except Exception as error:
+            result.update({'status': 'failed', 'error': f"{type(error).__name__}: {error}",
+                           'traceback': traceback.format_exc()})
+        result['seconds'] = round(time.perf_counter() - start_time, 3)
+        results.append(result)
+    return results
+
+
+def calibrate_results(results, output):
+    """
+    :param results: the result dicts of run_batch
+    :param output: the folder calibration_summary.csv and calibration.html are written to
+    :return: the calibration summary, one row per target of every experiment
+
+    :purpose: fits every curve in one call to fit_calibrations, so hundreds of experiments cost about as much as one
+    """
+    written = [result for result in results if result['status'] in ('done', 'skipped')]
+    if len(written) == 0:
+        print("no graph data to calibrate")
+        return None
+    names = [os.path.splitext(os.path.basename(result['graph data']))[0] for result in written]
+    data = load_calibration_data([result['graph data'] for result in written], labels=names)
+    summary, points = fit_calibrations(data)
+    experiments = pd.DataFrame({'curve': names, 'date': [result['date'] for result in written],
+                                'time': [result['time'] for result in written],
+                                'signal': [result['signal'] for result in written],
+                                'target retention time': [result['retention time'] for result in written]})
+    summary = experiments.merge(summary, on='curve')
+    export_summary(summary, os.path.join(output, CALIBRATION_FILE_NAME))
+    fig = overlay_calibration(make_figure(points), summary, points)
+    fig.update_layout(title=f"Calibration: {len(summary)} curves")
+    fig.write_html(os.path.join(output, CALIBRATION_FIGURE_NAME), include_plotlyjs='directory')
+    print(f"calibrated {len(summary)} curves, {summary['outliers'].sum()} outliers")
+    return summary
+
+
+def run_batch(settings):
+    """
+    :param settings: the batch settings, see DEFAULTS
+    :return: the result dicts of every target of every selected experiment, also written to batch_summary.json in the
+             output folder (and calibrated when the calibration setting is on)
+    """
+    settings = {**DEFAULTS, **settings}
+    settings['targets'] = [tuple(float(value) for value in target) for target in settings['targets']]
+    if len(settings['targets']) == 0:
+        raise ValueError("no targets given, add at least one (signal, retention time, flex time)")
+    if settings['format'] not in GRAPH_DATA_EXTENSIONS:
+        raise ValueError(f"unknown graph data format {settings['format']!r}, expected one of {list(GRAPH_DATA_EXTENSIONS)}")
+    os.makedirs(settings['output'], exist_ok=True)
+    experiments = select_experiments(settings['master_directory'], settings['experiments'], settings['since'],
+                                     settings['until'])
+    print(f"{len(experiments)} experiments, {len(settings['targets'])} targets, {settings['jobs']} at a time")
+    results = []
+    start_time = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=settings['jobs']) as executor:
+        futures = {executor.submit(process_experiment, *experiment, settings): experiment for experiment in experiments}
+        for future in as_completed(futures):
+            des_date, des_time, full_path = futures[future]
+            for result in future.result():
+                results.append(result)
+                message = result.get('error') or (f"{result['rows']} rows" if 'rows' in result else '')
+                print(f"{des_date} {des_time} {result['signal']:g} nm {result['retention time']:g} min: "
+                      f"{result['status']} {message}")
+    results.sort(key=lambda result: (result['date'], result['time'], result['signal'], result['retention time']))
+    with open(os.path.join(settings['output'], SUMMARY_FILE_NAME), 'w') as summary_file:
+        json.dump({'settings': settings, 'results': results}, summary_file, indent=1)
+    failed = sum(result['status'] == 'failed' for result in results)
+    print(f"finished in {time.perf_counter() - start_time:.1f} s: {len(results) - failed} targets done or skipped, "
+          f"{failed} failed")
+    if settings['calibration']:
+        calibrate_results(results, settings['output'])
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='write the graph data and figures of many HPLC experiments without Qt '
+                                                 'or a browser')
+    parser.add_argument('--config', help='a JSON file of settings, overridden by the arguments below')
+    parser.add_argument('--master-directory', help='the folder that holds a folder of experiments for every date')
+    parser.add_argument('--experiments', nargs='+', metavar='SELECTOR',
+                        help='"YYYY-MM-DD" or "YYYY-MM-DD HH-MM-SS" of the experiments, every experiment by default')
+    parser.add_argument('--since', help='the first date to include, YYYY-MM-DD')
+    parser.add_argument('--until', help='the last date to include, YYYY-MM-DD')
+    parser.add_argument('--target', nargs=3, type=float, action='append', dest='targets',
+                        metavar=('SIGNAL', 'RET_TIME', 'FLEX_TIME'), help='a target to graph, can be repeated')
+    parser.add_argument('--push-volumes', help='the folder of push_volumes.csv, the experiment folder by default')
+    parser.add_argument('--output', help='the folder the graph data, figures and batch_summary.json are written to')
+    parser.add_argument('--format', choices=sorted(GRAPH_DATA_EXTENSIONS), help='the graph data format')
+    parser.add_argument('--figures', choices=['html', 'png', 'svg', 'pdf', 'none'], help='the figure format')
+    parser.add_argument('--max-points', type=int, help='downsample figures with more points than this')
+    parser.add_argument('--jobs', type=int, help='the number of experiments processed at the same time')
+    parser.add_argument('--parser', choices=['native', 'aghplctools'], help='the Report.TXT parser')
+    parser.add_argument('--skip-existing', action='store_true', default=None,
+                        help='leave out the targets whose graph data and figure are already in the output folder')
+    parser.add_argument('--calibration', action='store_true', default=None,
+                        help=f'fit the calibration line of every target and write {CALIBRATION_FILE_NAME} and '
+                             f'{CALIBRATION_FIGURE_NAME} to the output folder')
+    args = vars(parser.parse_args(argv))
+    settings = load_config(args.pop('config')) if args.get('config') else {}
+    settings.update({key: value for key, value in args.items() if value is not None})
+    results = run_batch(settings)
+    return 1 if any(result['status'] == 'failed' for result in results) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,265 @@
+# author: Ioana David
+# benchmarks the graphing pipeline on synthetic HPLC data, so it can be run without the lab drive
+# usage: python benchmarks.py --injections 100 1000 10000 --workers 4 --output benchmark_results.jsonl
+#        python benchmarks.py --verify "path/to/PS_pushramp folder"   (checks report_parser against aghplctools)
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import tempfile
+import time
+import tracemalloc
+import pandas as pd
+from interactive_graphing import build_peak_table, discover_reports, get_directory_name, make_figure, parse_dict, \
+    pull_report, write_to_csv
+from graph_data import load_graph_data
+from peak_table import compare_with_pulled
+from report_cache import CACHE_FILE_NAME
+from report_parser import compare_parsers
+
+
+BENCHMARK_DATE = '2020-03-13'
+BENCHMARK_TIME = '10-00-00'
+SIGNALS = (210, 254, 280)
+# (retention time, response per uL) of the analytes in the synthetic reports; the response differs between signals
+ANALYTES = ((0.742, 12.5), (1.234, 48.0), (2.871, 7.9), (3.455, 30.2), (5.102, 3.3), (7.820, 18.6))
+TARGET = (254, 1.234, 0.05)     # the (signal, retention time, flex time) the pipeline stages are benchmarked with
+
+REPORT_HEADER = """=====================================================================
+Acq. Operator   : SYSTEM                         Seq. Line : {line:3d}
+Acq. Instrument : Instrument 1                   Location : Vial {vial}
+Injection Date  : 3/13/2020 10:00:00 AM                Inj :   1
+                                                Inj Volume : 1.000 \u00b5l
+Acq. Method     : C:\\Chem32\\1\\DATA\\PS_pushramp\\PUSHRAMP.M
+Last changed    : 3/13/2020 9:58:12 AM by SYSTEM
+=====================================================================
+                         Area Percent Report
+=====================================================================
+
+Sorted By             :      Signal
+Multiplier:                   : 1.0000
+Dilution:                     : 1.0000
+Use Multiplier & Dilution Factor with ISTDs
+
+"""
+SIGNAL_HEADER = """
+Signal {number}: DAD1 {letter}, Sig={signal},4 Ref=360,100
+
+Peak RetTime Type  Width     Area      Height     Area
+  #   [min]        [min]   [mAU*s]     [mAU]        %
+----|-------|----|-------|----------|----------|--------|
+"""
+REPORT_FOOTER = """
+=====================================================================
+                          *** End of Report ***
+"""
+
+
+def make_report(line, push_volume, rng):
+    """
+    :param line: the sequence line of the injection
+    :param push_volume: the volume pushed, which the peak areas are proportional to
+    :param rng: a random.Random
+    :return: the text of a Chemstation Report.TXT with a peak table for every signal
+    """
+    text = REPORT_HEADER.format(line=line, vial=line % 100 + 1)
+    for number, signal in enumerate(SIGNALS, start=1):
+        peaks = []
+        for ret_time, response in ANALYTES:
+            if rng.random() < 0.03:         # some peaks are missed by the integrator
+                continue
+            ret_time += rng.gauss(0, 0.004)
+            area = response * (signal / 254) * push_volume * rng.gauss(1, 0.02)
+            height = area / rng.uniform(2.5, 4.5)
+            peaks.append((ret_time, rng.choice(('BB', 'BV', 'VB', 'VV')), rng.uniform(0.03, 0.09), area, height))
+        total = sum(peak[3] for peak in peaks) or 1
+        text += SIGNAL_HEADER.format(number=number, letter='ABCDEFGH'[number - 1], signal=signal)
+        for index, (ret_time, peak_type, width, area, height) in enumerate(peaks, start=1):
+            text += f"{index:4d} {ret_time:7.3f} {peak_type:<4} {width:7.4f} {area:10.5f} {height:10.5f} " \
+                    f"{100 * area / total:8.4f}\n"
+        text += f"\nTotals :                 {total:10.5f} {sum(peak[4] for peak in peaks):10.5f}\n\n"
+    return text + REPORT_FOOTER
+
+
+def generate_dataset(master_directory, injections, seed=0):
+    """
+    :param master_directory: the folder to create the synthetic master directory in
+    :param injections: the number of injections (Report.TXT files) to make
+    :param seed: the seed of the random peaks
+    :return: the experiment folder, which also holds push_volumes.csv
+
+    :purpose: writes a PS_pushramp experiment laid out the way Chemstation does it, a .D folder per injection with a
+              UTF-16 Report.TXT inside, and the push volume of every injection
+    """
+    rng = random.Random(seed)
+    full_path = get_directory_name(BENCHMARK_DATE, BENCHMARK_TIME, master_directory)
+    push_volumes = [10 + 5 * (injection % 40) for injection in range(injections)]
+    for injection, push_volume in enumerate(push_volumes, start=1):
+        data_folder = os.path.join(full_path, f'{injection:03d}-P1-{chr(65 + injection % 8)}{injection % 12 + 1}-push.D')
+        os.makedirs(data_folder, exist_ok=True)
+        with open(os.path.join(data_folder, 'Report.TXT'), 'w', encoding='utf-16') as report:
+            report.write(make_report(injection, push_volume, rng))
+    pd.DataFrame({'push volume': push_volumes}).to_csv(os.path.join(full_path, 'push_volumes.csv'), index=False)
+    return full_path
+
+
+def measure(stage, function, files=None):
+    """
+    :param stage: the name of the stage
+    :param function: the function to time, called with no arguments
+    :param files: the number of files the stage went through, for the files per second
+    :return: the result of the function and a dict of the wall time, the peak Python memory of this process (worker
+             processes are not counted) and the files per second
+    """
+    tracemalloc.start()
+    start_time = time.perf_counter()
+    result = function()
+    wall_time = time.perf_counter() - start_time
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    measurement = {'stage': stage, 'wall_s': round(wall_time, 4), 'peak_mb': round(peak / 2 ** 20, 2)}
+    if files is not None:
+        measurement['files_per_s'] = round(files / max(wall_time, 1e-9), 1)
+    print(f"{stage:<28} {wall_time:9.3f} s {peak / 2 ** 20:9.1f} MB"
+          + (f" {measurement['files_per_s']:10.1f} files/s" if files is not None else ""))
+    return result, measurement
+
+
+def run_benchmarks(injections, workers, root=None):
+    """
+    :param injections: the number of injections in the synthetic experiment
+    :param workers: the number of processes for the parallel stages
+    :param root: the folder to generate the data in, a temporary folder by default
+    :return: a list of measurements, one per stage
+    """
+    master_directory = root if root is not None else tempfile.mkdtemp(prefix='hplc_benchmark_')
+    try:
+        print(f"\n{injections} injections, {len(SIGNALS)} signals, {workers} workers")
+        full_path, generate = measure('generate', lambda: generate_dataset(master_directory, injections), injections)
+        signal, ret_time, flex_time = TARGET
+        arguments = (BENCHMARK_DATE, BENCHMARK_TIME, ret_time, flex_time, signal, full_path)
+        cache_path = os.path.join(full_path, CACHE_FILE_NAME)
+        directories, discover = measure('discover_reports', lambda: list(discover_reports(full_path)), injections)
+        _, parse = measure('parse_dict', lambda: [parse_dict(directory, ret_time, flex_time, signal)
+                                                  for directory in directories], injections)
+        reference_pulled, reference = measure('pull_report (aghplctools)', lambda: [
+            pull_report(directory, 'aghplctools') for directory in directories], injections)
+        native_pulled, native = measure('pull_report (native)', lambda: [
+            pull_report(directory, 'native') for directory in directories], injections)
+        _, native_signal = measure('pull_report (native, 1 signal)', lambda: [
+            pull_report(directory, 'native', (signal,)) for directory in directories], injections)
+        arrays_pulled, native_arrays = measure('pull_report (native, arrays)', lambda: [
+            pull_report(directory, 'native', arrays=True) for directory in directories], injections)
+        _, serial = measure('write_to_csv (1 process)', lambda: write_to_csv(
+            *arguments, workers=1, use_cache=False, master_directory=master_directory), injections)
+        _, parallel = measure(f'write_to_csv ({workers} processes)', lambda: write_to_csv(
+            *arguments, workers=workers, use_cache=False, master_directory=master_directory), injections)
+        if os.path.exists(cache_path):
+            os.remove(cache_path)
+        _, cold = measure('write_to_csv (cold cache)', lambda: write_to_csv(
+            *arguments, workers=workers, master_directory=master_directory), injections)
+        graph_data, warm = measure('write_to_csv (warm cache)', lambda: write_to_csv(
+            *arguments, workers=workers, master_directory=master_directory), injections)
+        table, peak_table = measure('build_peak_table (cached)', lambda: build_peak_table(
+            BENCHMARK_DATE, BENCHMARK_TIME, workers=workers, master_directory=master_directory), injections)
+        _, peak_table_arrays = measure('build_peak_table (uncached, arrays)', lambda: build_peak_table(
+            BENCHMARK_DATE, BENCHMARK_TIME, workers=workers, use_cache=False, master_directory=master_directory),
+            injections)
+        targets = [(signal, analyte_time, flex_time) for signal in SIGNALS for analyte_time, response in ANALYTES]
+        _, query = measure(f'PeakTable.query ({len(targets)} targets)', lambda: table.query(targets), injections)
+        # a stage that gives wrong answers fast is not a result, so the peak table is checked before anything is saved
+        # the native arrays are checked against area_from_arrays, which makes it agree with area_from_pulled as well
+        for parser, pulled in (('aghplctools', reference_pulled), ('native', native_pulled),
+                               ('native arrays', arrays_pulled)):
+            mismatches = compare_with_pulled(zip(directories, pulled), targets)
+            if mismatches:
+                raise RuntimeError(f"PeakTable.query disagrees with the per-report lookup on {len(mismatches)} lookups "
+                                   f"of the {parser} parser's output, eg. {mismatches[0]}")
+        _, graph = measure('graph_stuff (no browser)', lambda: make_figure(load_graph_data(graph_data)).to_html(
+            include_plotlyjs=False))
+        measurements = [generate, discover, parse, reference, native, native_signal, native_arrays, serial, parallel,
+                        cold, warm, peak_table, peak_table_arrays, query, graph]
+        for measurement in measurements:
+            measurement.update({'injections': injections, 'signals': len(SIGNALS), 'workers': workers})
+        return measurements
+    finally:
+        if root is None:
+            shutil.rmtree(master_directory, ignore_errors=True)
+
+
+def save_results(measurements, output):
+    """
+    :param measurements: the measurements of run_benchmarks
+    :param output: the JSON Lines file to add the measurements to, one line per stage
+
+    :purpose: stamps every measurement with the time, commit and machine so runs can be compared later
+    """
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ''
+    run = {'run': time.strftime('%Y-%m-%dT%H:%M:%S'), 'commit': commit, 'python': platform.python_version(),
+           'machine': platform.node(), 'cpus': os.cpu_count()}
+    with open(output, 'a') as results_file:
+        for measurement in measurements:
+            results_file.write(json.dumps({**run, **measurement}) + '\n')
+
+
+def compare_results(output, threshold=0.10):
+    """
+    :param output: the JSON Lines file of saved measurements
+    :param threshold: the fraction by which a stage has to slow down to be flagged
+    :return: a DataFrame of the last two runs of every (stage, injections, workers), with the change in wall time
+    """
+    results = pd.read_json(output, lines=True)
+    rows = []
+    for (stage, injections, workers), group in results.groupby(['stage', 'injections', 'workers'], sort=False):
+        runs = group.sort_values('run')
+        if len(runs) < 2:
+            continue
+        before, after = runs.iloc[-2], runs.iloc[-1]
+        change = (after['wall_s'] - before['wall_s']) / max(before['wall_s'], 1e-9)
+        rows.append({'stage': stage, 'injections': injections, 'workers': workers, 'before_s': before['wall_s'],
+                     'after_s': after['wall_s'], 'change': round(change, 3), 'regression': change > threshold,
+                     'before_commit': before['commit'], 'after_commit': after['commit']})
+    comparison = pd.DataFrame(rows)
+    if len(comparison):
+        print(comparison.to_string(index=False))
+    return comparison
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='benchmark the HPLC graphing pipeline on synthetic data')
+    parser.add_argument('--injections', type=int, nargs='+', default=[100, 1000],
+                        help='the sizes of the synthetic experiments, 100 to 100000 injections')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='processes for the parallel stages')
+    parser.add_argument('--output', default='benchmark_results.jsonl', help='the JSON Lines file to add results to')
+    parser.add_argument('--root', default=None, help='generate the data here and keep it, rather than a temp folder')
+    parser.add_argument('--compare', action='store_true', help='compare the last two saved runs of every stage')
+    parser.add_argument('--verify', nargs='?', const='', default=None, metavar='EXPERIMENT_FOLDER',
+                        help='check that report_parser gives the same peaks as aghplctools for every report of an '
+                             'experiment (a synthetic one if no folder is given), then exit')
+    args = parser.parse_args()
+    if args.verify is not None:
+        verify_root = None if args.verify else tempfile.mkdtemp(prefix='hplc_verify_')
+        try:
+            folder = args.verify or generate_dataset(verify_root, args.injections[0])
+            reports = list(discover_reports(folder))
+            mismatches = compare_parsers(reports)
+            for directory, description in mismatches:
+                print(f"{directory}: {description}")
+            print(f"{len(reports) - len(mismatches)} of {len(reports)} reports parsed the same by both parsers")
+        finally:
+            if verify_root is not None:
+                shutil.rmtree(verify_root, ignore_errors=True)
+        raise SystemExit(1 if mismatches else 0)
+    if not args.compare:
+        for size in args.injections:
+            root = os.path.join(args.root, str(size)) if args.root is not None else None
+            save_results(run_benchmarks(size, args.workers, root), args.output)
+    compare_results(args.output)
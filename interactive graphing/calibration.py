@@ -0,0 +1,250 @@
+# author: Ioana David
+# fits the calibration lines (area against push volume) of many experiments and targets at once: least squares and
+# Huber fits, residuals, LOD/LOQ and the linear range of every curve, with the outliers flagged, all with NumPy group
+# sums rather than a loop over the curves
+
+import os
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+from graph_data import load_graph_data
+
+
+HUBER_C = 1.345             # the Huber tuning constant, 95% efficient when the residuals are normal
+MAD_TO_SIGMA = 1.4826       # turns the median absolute deviation into a standard deviation for normal residuals
+
+
+def load_calibration_data(paths, labels=None):
+    """
+    :param paths: the graph data files (from write_to_csv or batch_graphing) of the curves to fit
+    :param labels: a name for each curve, the file name without its extension by default
+    :return: one long DataFrame of every point, with the curve it belongs to in the 'curve' column
+    """
+    frames = []
+    for index, path in enumerate(paths):
+        data = load_graph_data(path)
+        data.insert(0, 'curve', labels[index] if labels is not None else os.path.splitext(os.path.basename(path))[0])
+        frames.append(data)
+    return pd.concat(frames, ignore_index=True)
+
+
+def _group_sums(groups, n_groups, *values):
+    return [np.bincount(groups, weights=value, minlength=n_groups) for value in values]
+
+
+def _weighted_lines(groups, n_groups, x, y, weights):
+    """
+    :return: the slope and intercept of the weighted least squares line of every group
+    """
+    sw, swx, swy, swxx, swxy = _group_sums(groups, n_groups, weights, weights * x, weights * y, weights * x * x,
+                                           weights * x * y)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        slope = (sw * swxy - swx * swy) / (sw * swxx - swx ** 2)
+        intercept = (swy - slope * swx) / sw
+    return slope, intercept
+
+
+def group_median(values, groups, n_groups):
+    """
+    :param values: a float array
+    :param groups: the group of each value, ints from 0 to n_groups - 1
+    :param n_groups: the number of groups
+    :return: the median of the values of every group (NaN for an empty group), from one sort of all the values
+    """
+    order = np.lexsort((values, groups))
+    counts = np.bincount(groups, minlength=n_groups)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    medians = np.full(n_groups, np.nan)
+    present = counts > 0
+    sorted_values = values[order]
+    lower = sorted_values[starts[present] + (counts[present] - 1) // 2]
+    upper = sorted_values[starts[present] + counts[present] // 2]
+    medians[present] = (lower + upper) / 2
+    return medians
+
+
+def middle_half(values, groups, n_groups):
+    """
+    :param values: a float array
+    :param groups: the group of each value, ints from 0 to n_groups - 1
+    :param n_groups: the number of groups
+    :return: a bool array that is True for the values between the first and third quartile of their group
+    """
+    order = np.lexsort((values, groups))
+    counts = np.bincount(groups, minlength=n_groups)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    ranks = np.empty(len(values))
+    ranks[order] = np.arange(len(values)) - starts[groups[order]]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        fractions = ranks / (counts[groups] - 1)
+    return (fractions >= 0.25) & (fractions <= 0.75) | (counts[groups] < 4)
+
+
+def huber_lines(groups, n_groups, x, y, max_iterations=50, tolerance=1e-8):
+    """
+    :return: the slope, intercept and robust residual scale of the Huber fit of every group, and the final weight of
+             every point (1 for a point the fit trusts fully, less for a point far from the line)
+
+    :purpose: iteratively reweighted least squares, every group being updated in the same array operations; the
+              residual scale is the MAD of the residuals, and starts from the least squares line
+    """
+    weights = np.ones_like(x)
+    slope, intercept = _weighted_lines(groups, n_groups, x, y, weights)
+    for iteration in range(max_iterations):
+        residuals = y - (intercept[groups] + slope[groups] * x)
+        scale = MAD_TO_SIGMA * group_median(np.abs(residuals), groups, n_groups)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            u = np.abs(residuals) / (HUBER_C * scale[groups])
+            weights = np.where(u <= 1, 1.0, 1.0 / u)
+        weights = np.where(np.isfinite(weights), weights, 1.0)      # a perfect fit has no scale to divide by
+        new_slope, new_intercept = _weighted_lines(groups, n_groups, x, y, weights)
+        change = np.nanmax(np.abs(np.concatenate((new_slope - slope, new_intercept - intercept))), initial=0.0)
+        slope, intercept = new_slope, new_intercept
+        if change <= tolerance * max(1.0, np.nanmax(np.abs(y), initial=0.0)):
+            break
+    residuals = y - (intercept[groups] + slope[groups] * x)
+    scale = MAD_TO_SIGMA * group_median(np.abs(residuals), groups, n_groups)
+    return slope, intercept, scale, weights
+
+
+def fit_calibrations(data, by=('curve',), x='push volume', y='area', outlier_threshold=3.5, linearity_tolerance=0.05,
+                     max_refinements=10):
+    """
+    :param data: a long DataFrame of points, eg. from load_calibration_data
+    :param by: the columns that tell the curves apart, eg. ('curve',) or ('date', 'time', 'signal', 'target retention time')
+    :param x: the column of the amount injected
+    :param y: the column of the response
+    :param outlier_threshold: the number of robust standard deviations from the Huber line beyond which a point is
+                              an outlier
+    :param linearity_tolerance: the relative deviation from the line of the linear range, as a fraction, up to which the
+                                response is counted as linear (only a deviation of more than 3 sigma counts)
+    :param max_refinements: the most times the line of the linear range is refitted
+    :return summary: one row per curve with the least squares fit of its inliers (slope, intercept, R^2, residual
+                     standard deviation, LOD = 3.3 sigma / slope and LOQ = 10 sigma / slope, in units of x), the Huber
+                     fit of all its points, the number of outliers, and the linear range and the line fitted to it
+    :return points: the points with the fitted value, residual, Huber weight, outlier flag and linear range flag of each
+    """
+    by = list(by)
+    points = data.dropna(subset=[x, y]).reset_index(drop=True)
+    keys = points[by].drop_duplicates().sort_values(by).reset_index(drop=True)
+    groups = pd.MultiIndex.from_frame(keys).get_indexer(pd.MultiIndex.from_frame(points[by]))
+    n_groups = len(keys)
+    xs = points[x].to_numpy(dtype=np.float64)
+    ys = points[y].to_numpy(dtype=np.float64)
+
+    # the Huber fit finds the outliers, then the least squares line is fitted to the inliers only
+    robust_slope, robust_intercept, robust_scale, weights = huber_lines(groups, n_groups, xs, ys)
+    robust_residuals = ys - (robust_intercept[groups] + robust_slope[groups] * xs)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        outlier = np.abs(robust_residuals) > outlier_threshold * robust_scale[groups]
+    inlier = (~outlier).astype(np.float64)
+    slope, intercept = _weighted_lines(groups, n_groups, xs, ys, inlier)
+    fitted = intercept[groups] + slope[groups] * xs
+    residuals = ys - fitted
+    n, sum_y, sum_yy, sum_squares = _group_sums(groups, n_groups, inlier, inlier * ys, inlier * ys * ys,
+                                                inlier * residuals ** 2)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        sigma = np.sqrt(sum_squares / (n - 2))
+        r_squared = 1 - sum_squares / (sum_yy - sum_y ** 2 / n)
+        lod = 3.3 * sigma / np.abs(slope)
+        loq = 10 * sigma / np.abs(slope)
+
+    # the linear range is the run of inliers around the middle push volume of a curve that stays close to the line,
+    # both relatively and compared to the noise, and above the quantitation limit (below which the relative deviation
+    # is mostly noise); a bend at either end pulls a line fitted to every point towards it, so the range starts from
+    # the line of the middle half of the push volumes and is widened or narrowed, the line and its MAD scale refitted
+    # to the points of the range each time, until it stops changing
+    middle_x = group_median(xs, groups, n_groups)
+    linear = ~outlier & middle_half(xs, groups, n_groups)
+    line_slope, line_intercept = _weighted_lines(groups, n_groups, xs, ys, linear.astype(np.float64))
+    for refinement in range(max_refinements):
+        line = line_intercept[groups] + line_slope[groups] * xs
+        line_scale = MAD_TO_SIGMA * group_median(np.abs(ys - line)[linear], groups[linear], n_groups)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            limit = 10 * line_scale / np.abs(line_slope)
+        deviation = np.abs(ys - line)
+        bad = ~outlier & ((xs < limit[groups]) | (deviation > linearity_tolerance * np.abs(line)) &
+                          (deviation > 3 * line_scale[groups]))
+        below = bad & (xs < middle_x[groups])
+        above = bad & (xs >= middle_x[groups])
+        last_bad_below = np.full(n_groups, -np.inf)
+        first_bad_above = np.full(n_groups, np.inf)
+        np.maximum.at(last_bad_below, groups[below], xs[below])
+        np.minimum.at(first_bad_above, groups[above], xs[above])
+        new_linear = ~outlier & (xs > last_bad_below[groups]) & (xs < first_bad_above[groups])
+        if np.array_equal(new_linear, linear):
+            break
+        linear = new_linear
+        line_slope, line_intercept = _weighted_lines(groups, n_groups, xs, ys, linear.astype(np.float64))
+    linear_min = np.full(n_groups, np.inf)
+    linear_max = np.full(n_groups, -np.inf)
+    np.minimum.at(linear_min, groups[linear], xs[linear])
+    np.maximum.at(linear_max, groups[linear], xs[linear])
+
+    summary = keys.copy()
+    summary['points'] = np.bincount(groups, minlength=n_groups)
+    summary['outliers'] = np.bincount(groups, weights=outlier, minlength=n_groups).astype(int)
+    summary['slope'] = slope
+    summary['intercept'] = intercept
+    summary['r squared'] = r_squared
+    summary['residual std'] = sigma
+    summary['lod'] = lod
+    summary['loq'] = loq
+    summary['robust slope'] = robust_slope
+    summary['robust intercept'] = robust_intercept
+    summary['robust scale'] = robust_scale
+    summary['linear slope'] = line_slope
+    summary['linear intercept'] = line_intercept
+    summary['linear range min'] = np.where(np.isfinite(linear_min), linear_min, np.nan)
+    summary['linear range max'] = np.where(np.isfinite(linear_max), linear_max, np.nan)
+
+    points['fitted'] = fitted
+    points['residual'] = residuals
+    points['huber weight'] = weights
+    points['outlier'] = outlier
+    points['linear'] = linear
+    return summary, points
+
+
+def overlay_calibration(fig, summary, points, by=('curve',), x='push volume', y='area'):
+    """
+    :param fig: the plotly figure of the points, eg. from make_figure
+    :param summary: the summary of fit_calibrations
+    :param points: the points of fit_calibrations
+    :param by: the columns that tell the curves apart
+    :param x: the column of the amount injected
+    :param y: the column of the response
+    :return: the figure, with the least squares line of every curve (as one trace, however many curves there are)
+             and the outliers circled
+    """
+    by = list(by)
+    ranges = points.groupby(by)[x].agg(['min', 'max']).reset_index()
+    lines = summary.merge(ranges, on=by)
+    line_x = np.column_stack((lines['min'], lines['max'], np.full(len(lines), np.nan))).ravel()
+    line_y = np.column_stack((lines['intercept'] + lines['slope'] * lines['min'],
+                              lines['intercept'] + lines['slope'] * lines['max'],
+                              np.full(len(lines), np.nan))).ravel()
+    names = lines[by].astype(str).agg(' '.join, axis=1)
+    hover = np.repeat([f"{name}<br>slope {slope:.4g}, R² {r_squared:.4f}<br>LOD {lod:.3g}, LOQ {loq:.3g}"
+                       for name, slope, r_squared, lod, loq in
+                       zip(names, lines['slope'], lines['r squared'], lines['lod'], lines['loq'])], 3)
+    fig.add_trace(go.Scattergl(x=line_x, y=line_y, mode='lines', name='calibration', text=hover,
+                               hoverinfo='text', line=dict(color='black', width=1)))
+    outliers = points[points['outlier']]
+    fig.add_trace(go.Scattergl(x=outliers[x], y=outliers[y], mode='markers', name='outliers',
+                               marker=dict(symbol='circle-open', size=12, color='red')))
+    return fig
+
+
+def export_summary(summary, path):
+    """
+    :param summary: the summary of fit_calibrations
+    :param path: a .csv, .parquet or .xlsx file
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.parquet':
+        summary.to_parquet(path, index=False)
+    elif extension == '.xlsx':
+        summary.to_excel(path, index=False)
+    else:
+        summary.to_csv(path, index=False)
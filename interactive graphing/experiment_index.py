@@ -0,0 +1,187 @@
+# author: Ioana David
+
+import json
+import os
+import re
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+from interactive_graphing import MASTER_DIRECTORY, discover_reports, pull_reports
+from peak_table import PeakTable
+from report_cache import ReportCache
+
+
+INDEX_FILE_NAME = 'experiment_index.sqlite'
+EXPERIMENT_FOLDER = re.compile(r'^PS_pushramp (?P<date>\d{4}-\d{2}-\d{2}) (?P<time>\d{2}-\d{2}-\d{2})$')
+
+
+def find_experiments(master_directory=MASTER_DIRECTORY):
+    """
+    :param master_directory: the folder that holds a folder of experiments for every date
+    :return: a list of (date, time, full path) of every PS_pushramp folder, sorted by date and time
+    """
+    experiments = []
+    with os.scandir(master_directory) as date_entries:
+        for date_entry in date_entries:
+            if not date_entry.is_dir():
+                continue
+            with os.scandir(date_entry.path) as entries:
+                for entry in entries:
+                    match = EXPERIMENT_FOLDER.match(entry.name)
+                    if match is not None and entry.is_dir():
+                        experiments.append((match.group('date'), match.group('time'), entry.path))
+    return sorted(experiments)
+
+
+def _fingerprint(full_path):
+    """
+    :return: the reports of an experiment and a (count, newest mtime) pair that changes when a report is added or rewritten
+    """
+    directories = list(discover_reports(full_path))
+    newest = max((os.stat(directory).st_mtime_ns for directory in directories), default=0)
+    return directories, [len(directories), newest]
+
+
+def _index_experiment(full_path, known_fingerprint=None):
+    """
+    :param full_path: the path to the experiment folder
+    :param known_fingerprint: the fingerprint the index holds for the experiment, or None if it is new
+    :return: None if the fingerprint is unchanged, otherwise the number of injections, the signals present and the
+             new fingerprint, with every report pulled into the experiment's ReportCache
+
+    :purpose: runs in a worker process, so the folder is walked once per experiment and in parallel, the same list of
+              reports giving the fingerprint and being pulled
+    """
+    directories, fingerprint = _fingerprint(full_path)
+    if fingerprint == known_fingerprint:
+        return None
+    signals = set()
+    with ReportCache.for_experiment(full_path) as cache:
+        for directory, dictionary in pull_reports(directories, cache=cache):
+            signals.update(float(signal) for signal in dictionary)
+    return len(directories), sorted(signals), fingerprint
+
+
+def _query_experiment(full_path, targets):
+    """
+    :param full_path: the path to the experiment folder
+    :param targets: a list of (signal, retention time, flex time) tuples
+    :return: the long DataFrame of PeakTable.to_frame for the experiment
+    """
+    with ReportCache.for_experiment(full_path) as cache:
+        table = PeakTable.from_pulled(pull_reports(discover_reports(full_path), cache=cache))
+    return table.to_frame(targets)
+
+
+class ExperimentIndex:
+    """
+    a persistent index of every PS_pushramp experiment in the master directory
+
+    the index records the date, time, number of injections and signals of every experiment, and the peak tables stay
+    in the ReportCache of each experiment folder, so a query across many experiments only parses the reports that
+    are new. experiments are indexed and queried in parallel, one experiment per process
+    """
+
+    def __init__(self, master_directory=MASTER_DIRECTORY, index_path=None):
+        """
+        :param master_directory: the folder that holds a folder of experiments for every date
+        :param index_path: the path to the SQLite index, by default in the master directory
+        """
+        self.master_directory = master_directory
+        self.index_path = index_path if index_path is not None else os.path.join(master_directory, INDEX_FILE_NAME)
+        self._connection = sqlite3.connect(self.index_path)
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS experiments ('
+            'path TEXT PRIMARY KEY, date TEXT, time TEXT, injections INTEGER, signals TEXT, fingerprint TEXT, '
+            'indexed REAL)'
+        )
+        self._connection.commit()
+
+    def update(self, workers=None):
+        """
+        :param workers: the number of processes to index with, None uses every core
+        :return: the number of experiments that were (re)indexed
+
+        :purpose: adds new experiments to the index and refreshes the ones whose reports changed, removing the ones
+                  that no longer exist
+        """
+        experiments = find_experiments(self.master_directory)
+        known = {path: json.loads(fingerprint) for path, fingerprint in
+                 self._connection.execute('SELECT path, fingerprint FROM experiments')}
+        indexed = 0
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # every experiment goes to the pool, which walks it once and only pulls its reports if it changed
+            results = executor.map(_index_experiment, [full_path for des_date, des_time, full_path in experiments],
+                                   [known.get(full_path) for des_date, des_time, full_path in experiments])
+            for (des_date, des_time, full_path), result in zip(experiments, results):
+                if result is None:
+                    continue
+                injections, signals, fingerprint = result
+                self._connection.execute(
+                    'INSERT OR REPLACE INTO experiments (path, date, time, injections, signals, fingerprint, indexed) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    (full_path, des_date, des_time, injections, json.dumps(signals), json.dumps(fingerprint), time.time())
+                )
+                indexed += 1
+                print(f"indexed {full_path}: {injections} injections, signals {signals}")
+        existing = set(full_path for des_date, des_time, full_path in experiments)
+        removed = [(path,) for path in known if path not in existing]
+        self._connection.executemany('DELETE FROM experiments WHERE path = ?', removed)
+        self._connection.commit()
+        return indexed
+
+    def experiments(self, start_date=None, end_date=None, signal=None):
+        """
+        :param start_date: the first date to include, 'YYYY-MM-DD', or None
+        :param end_date: the last date to include, 'YYYY-MM-DD', or None
+        :param signal: only include the experiments that recorded this wavelength, or None
+        :return: a DataFrame of the indexed experiments
+        """
+        data = pd.read_sql_query('SELECT path, date, time, injections, signals FROM experiments ORDER BY date, time',
+                                 self._connection)
+        data['signals'] = data['signals'].map(json.loads)
+        if start_date is not None:
+            data = data[data['date'] >= start_date]
+        if end_date is not None:
+            data = data[data['date'] <= end_date]
+        if signal is not None:
+            data = data[data['signals'].map(lambda signals: float(signal) in signals)]
+        return data.reset_index(drop=True)
+
+    def query(self, targets, start_date=None, end_date=None, workers=None):
+        """
+        :param targets: a list of (signal, retention time, flex time) tuples
+        :param start_date: the first date to include, 'YYYY-MM-DD', or None
+        :param end_date: the last date to include, 'YYYY-MM-DD', or None
+        :param workers: the number of processes to query with, None uses every core
+        :return: one DataFrame of every target found in every injection of the matching experiments, with the date,
+                 time and path of the experiment
+
+        eg. the area of the peak at 3.2 min at 254 nm across all ramps in March:
+            index.query([(254, 3.2, 0.1)], start_date='2020-03-01', end_date='2020-03-31')
+        """
+        experiments = self.experiments(start_date, end_date)
+        signals = set(float(target[0]) for target in targets)
+        experiments = experiments[experiments['signals'].map(lambda present: not signals.isdisjoint(present))]
+        frames = []
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(_query_experiment, experiments['path'], [targets] * len(experiments))
+            for (_, experiment), frame in zip(experiments.iterrows(), results):
+                frame.insert(0, 'experiment', experiment['path'])
+                frame.insert(0, 'time', experiment['time'])
+                frame.insert(0, 'date', experiment['date'])
+                frames.append(frame)
+        if len(frames) == 0:
+            return pd.DataFrame(columns=['date', 'time', 'experiment', 'signal', 'target retention time', 'injection',
+                                         'retention time', 'area', 'directory'])
+        return pd.concat(frames, ignore_index=True)
+
+    def close(self):
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
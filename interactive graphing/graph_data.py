@@ -0,0 +1,131 @@
+# author: Ioana David
+
+import csv
+import os
+import pandas as pd
+
+
+GRAPH_DATA_COLUMNS = ["retention time", "area", "push volume", "directory"]
+# the Arrow type of each column of the columnar formats; push_volume_at gives ints for whole volumes, so the types are
+# fixed up front rather than inferred from each batch
+GRAPH_DATA_TYPES = {"retention time": 'float64', "area": 'float64', "push volume": 'float64', "directory": 'string'}
+GRAPH_DATA_EXTENSIONS = {'csv': '.csv', 'parquet': '.parquet', 'arrow': '.arrow'}
+
+
+def graph_data_path(full_path, output_format='csv'):
+    """
+    :param full_path: the path to the experiment folder
+    :param output_format: 'csv', 'parquet' or 'arrow' (Arrow IPC)
+    :return: the path of the graph data file in the experiment folder
+    """
+    if output_format not in GRAPH_DATA_EXTENSIONS:
+        raise ValueError(f"unknown graph data format {output_format!r}, expected one of {list(GRAPH_DATA_EXTENSIONS)}")
+    return os.path.join(full_path, 'graph_data' + GRAPH_DATA_EXTENSIONS[output_format])
+
+
+class GraphDataWriter:
+    """
+    keeps the graph data file open and writes the rows in batches
+
+    CSV files are written with a single csv.writer. parquet and Arrow IPC files are written through pyarrow, one row
+    group or record batch per batch of rows, so they can be loaded without parsing any text
+    """
+
+    def __init__(self, file_name, output_format='csv', batch_size=1000, columns=GRAPH_DATA_COLUMNS,
+                 types=GRAPH_DATA_TYPES):
+        """
+        :param file_name: the path of the file to write, its contents are replaced
+        :param output_format: 'csv', 'parquet' or 'arrow' (Arrow IPC)
+        :param batch_size: the number of rows held in memory before they are written
+        :param columns: the names of the columns
+        :param types: the Arrow type name of each column for the columnar formats, a column that is not in it is a
+                      string; every batch, and an empty file, is written with this one schema
+        """
+        if output_format not in GRAPH_DATA_EXTENSIONS:
+            raise ValueError(f"unknown graph data format {output_format!r}, expected one of {list(GRAPH_DATA_EXTENSIONS)}")
+        self.file_name = file_name
+        self.output_format = output_format
+        self.batch_size = batch_size
+        self.columns = list(columns)
+        self.rows_written = 0
+        self._rows = []
+        self._writer = None
+        if output_format == 'csv':
+            self._file = open(file_name, 'w', newline='')
+            self._csv_writer = csv.writer(self._file, delimiter=",")
+            self._csv_writer.writerow(self.columns)
+        else:
+            import pyarrow      # only needed for the columnar formats
+            self._file = None
+            self._schema = pyarrow.schema([(column, types.get(column, 'string')) for column in self.columns])
+
+    def writerow(self, row):
+        """
+        :param row: one row of values, in the same order as the columns
+        """
+        self._rows.append(row)
+        if len(self._rows) >= self.batch_size:
+            self.flush()
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
+
+    def flush(self):
+        """
+        :purpose: writes the rows held in memory to the file
+        """
+        if len(self._rows) == 0:
+            return
+        if self.output_format == 'csv':
+            self._csv_writer.writerows(self._rows)
+            self._file.flush()
+        else:
+            self._write_batch(self._rows)
+        self.rows_written += len(self._rows)
+        self._rows = []
+
+    def _write_batch(self, rows):
+        import pyarrow
+        table = pyarrow.Table.from_pandas(pd.DataFrame(rows, columns=self.columns), schema=self._schema,
+                                          preserve_index=False)
+        self._open_writer()
+        self._writer.write_table(table)
+
+    def _open_writer(self):
+        if self._writer is not None:
+            return
+        if self.output_format == 'parquet':
+            import pyarrow.parquet
+            self._writer = pyarrow.parquet.ParquetWriter(self.file_name, self._schema)
+        else:
+            import pyarrow.ipc
+            self._writer = pyarrow.ipc.new_file(self.file_name, self._schema)
+
+    def close(self):
+        self.flush()
+        if self.output_format == 'csv':
+            self._file.close()
+        else:
+            # with nothing written, an empty file with the same schema is still made
+            self._open_writer()
+            self._writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def load_graph_data(graph_data):
+    """
+    :param graph_data: the path to a graph data file written by GraphDataWriter
+    :return: a DataFrame of the graph data, loaded with the reader that matches the file extension
+    """
+    extension = os.path.splitext(graph_data)[1].lower()
+    if extension == '.parquet':
+        return pd.read_parquet(graph_data)
+    if extension in ('.arrow', '.feather'):
+        return pd.read_feather(graph_data)
+    return pd.read_csv(graph_data)
@@ -0,0 +1,294 @@
+# author: Ioana David
+# the Qt windows of the HPLC graphing pipeline, kept apart from interactive_graphing so the pipeline can be imported
+# on a machine without Qt (eg. by batch_graphing.py)
+# usage: python graphing_gui.py (or python interactive_graphing.py)
+
+import json
+import os
+import sys
+import threading
+import pandas as pd
+from PyQt5 import QtCore, QtGui, QtWidgets, uic
+from PyQt5.QtCore import QDate, QTime
+from interactive_graphing import WEBGL_THRESHOLD, ReportWatcher, get_directory_name, graph_stuff, make_figure, \
+    write_to_csv
+from graph_data import GRAPH_DATA_COLUMNS, graph_data_path
+from push_volumes import load_push_volumes
+from report_cache import ReportCache
+
+
+class graphingGui(QtWidgets.QMainWindow):
+    def __init__(self, parent=None):
+        super(graphingGui, self).__init__()
+        uic.loadUi('graph_gui.ui', self)
+
+        self.okButton = self.findChild(QtWidgets.QPushButton, 'okButton')
+        self.okButton.clicked.connect(self.ok_button_pressed)
+
+        # cancels the queries that are running or queued, and closes the window when there are none
+        self.cancelButton = self.findChild(QtWidgets.QPushButton, 'cancelButton')
+        self.cancelButton.clicked.connect(self.cancel_button_pressed)
+
+        # the queries run one after another on a background thread so the window stays responsive
+        self.thread_pool = QtCore.QThreadPool(self)
+        self.thread_pool.setMaxThreadCount(1)
+        self.workers = []
+
+    def ok_button_pressed(self):
+        # getting the date
+        raw_date = self.dateEdit.date()             # type str
+        des_date = str(QDate.toPyDate(raw_date))
+        print("desired date:", des_date)
+
+        # getting the time
+        raw_time = self.timeEdit.time()             # type str
+        str_time = str(QTime.toPyTime(raw_time))
+        seg_1 = str_time[0:2]
+        seg_2 = str_time[3:5]
+        seg_3 = str_time[6:]
+        des_time = seg_1 + '-' + seg_2 + '-' + seg_3
+        print("desired time:", des_time)
+
+        # getting the ret_time
+        ret_time = float(self.retTimeBox.text())    # type float
+        print("ret time:", ret_time)
+
+        # getting the flex_time
+        flex_time = float(self.flexTimeBox.text())  # type float
+        print("flex time:", flex_time)
+
+        # getting the directory
+        directory = self.directoryLineEdit.text()   # type str
+        print("directory:", directory)
+
+        # getting the signal
+        sig = self.signalComboBox.currentText()     # type str
+        des_sig = int(sig[0:3])
+        print("signal:", sig)
+        print("des_sig:", des_sig)
+
+        if self.watchCheckBox.isChecked():
+            # keeps parsing the new injections as they come in and adds them to an open graph
+            full_path = get_directory_name(des_date, des_time)
+            watcher = ReportWatcher(full_path, ret_time, flex_time, des_sig, load_push_volumes(directory),
+                                    graph_data_path(full_path),
+                                    cache=ReportCache.for_experiment(full_path, check_same_thread=False))
+            self.live_window = liveGraphGui(watcher)
+            self.live_window.show()
+            return
+
+        worker = ingestionWorker(des_date, des_time, ret_time, flex_time, des_sig, directory, workers=None)
+        worker.signals.progress.connect(self.show_progress)
+        worker.signals.finished.connect(self.ingestion_finished)
+        worker.signals.cancelled.connect(self.ingestion_cancelled)
+        worker.signals.error.connect(self.ingestion_failed)
+        self.workers.append(worker)
+        self.thread_pool.start(worker)
+        self.statusbar.showMessage(f"{len(self.workers)} queries queued")
+
+    def cancel_button_pressed(self):
+        if len(self.workers) == 0:
+            self.close()
+            return
+        for worker in self.workers:
+            worker.cancel()
+        self.statusbar.showMessage("cancelling ...")
+
+    def show_progress(self, parsed, matched, total, elapsed):
+        eta = elapsed / parsed * (total - parsed) if parsed else 0
+        queued = f", {len(self.workers) - 1} more queued" if len(self.workers) > 1 else ""
+        self.statusbar.showMessage(f"{parsed}/{total} files parsed, {matched} rows matched, "
+                                   f"about {eta:.0f} s left{queued}")
+
+    def ingestion_finished(self, graph_data):
+        self.workers.pop(0)
+        self.statusbar.showMessage(f"wrote {graph_data}")
+        graph_stuff(graph_data)
+
+    def ingestion_cancelled(self):
+        self.workers.pop(0)
+        self.statusbar.showMessage("query cancelled")
+
+    def ingestion_failed(self, message):
+        self.workers.pop(0)
+        self.statusbar.showMessage(f"query failed: {message}")
+        print(message)
+
+
+class ingestionSignals(QtCore.QObject):
+    progress = QtCore.pyqtSignal(int, int, int, float)     # files parsed, rows matched, total files, elapsed seconds
+    finished = QtCore.pyqtSignal(str)                       # the path to the graph data
+    cancelled = QtCore.pyqtSignal()
+    error = QtCore.pyqtSignal(str)
+
+
+class ingestionWorker(QtCore.QRunnable):
+    """
+    runs write_to_csv on a QThreadPool thread, reporting its progress through signals so the GUI stays responsive
+    """
+
+    def __init__(self, *args, progress_interval=0.25, **kwargs):
+        """
+        :param args: the arguments of write_to_csv
+        :param progress_interval: the least number of seconds between two progress signals
+        :param kwargs: the keyword arguments of write_to_csv
+        """
+        super(ingestionWorker, self).__init__()
+        self.setAutoDelete(False)
+        self.args = args
+        self.kwargs = kwargs
+        self.progress_interval = progress_interval
+        self.signals = ingestionSignals()
+        self.cancel_event = threading.Event()
+        self._last_progress = 0
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def report_progress(self, parsed, matched, total, elapsed):
+        # every file would flood the event loop, so only a few signals a second are sent
+        if elapsed - self._last_progress >= self.progress_interval or parsed == total:
+            self._last_progress = elapsed
+            self.signals.progress.emit(parsed, matched, total, elapsed)
+
+    def run(self):
+        if self.cancel_event.is_set():      # cancelled while it was still queued
+            self.signals.cancelled.emit()
+            return
+        try:
+            graph_data = write_to_csv(*self.args, progress=self.report_progress, cancel=self.cancel_event, **self.kwargs)
+        except Exception as error:
+            self.signals.error.emit(f"{type(error).__name__}: {error}")
+            return
+        if graph_data is None:
+            self.signals.cancelled.emit()
+        else:
+            self.signals.finished.emit(graph_data)
+
+
+class pollSignals(QtCore.QObject):
+    polled = QtCore.pyqtSignal(list)        # the new rows of the poll
+    error = QtCore.pyqtSignal(str)
+
+
+class pollWorker(QtCore.QRunnable):
+    """
+    runs one ReportWatcher.poll on a QThreadPool thread, so parsing the reports never blocks the window
+    """
+
+    def __init__(self, watcher):
+        """
+        :param watcher: the ReportWatcher to poll
+        """
+        super(pollWorker, self).__init__()
+        self.watcher = watcher
+        self.signals = pollSignals()
+
+    def run(self):
+        try:
+            rows = self.watcher.poll()
+        except Exception as error:
+            self.signals.error.emit(f"{type(error).__name__}: {error}")
+            return
+        self.signals.polled.emit(rows)
+
+
+class liveGraphGui(QtWidgets.QMainWindow):
+    """
+    shows the graph of an experiment that is still running, polling a ReportWatcher and pushing the new points into
+    the open figure with Plotly.extendTraces rather than redrawing it
+
+    the polls run on a background thread, one at a time, and their rows come back to update_graph through a signal;
+    the first poll parses every report already written, so the graph is only drawn once it is done
+    """
+
+    def __init__(self, watcher, interval=15, parent=None):
+        """
+        :param watcher: the ReportWatcher of the experiment
+        :param interval: the number of seconds between polls
+        """
+        super(liveGraphGui, self).__init__(parent)
+        from PyQt5 import QtWebEngineWidgets        # from the PyQtWebEngine package, only needed for watch mode
+        self.watcher = watcher
+        self.setWindowTitle('HPLC Graph (live)')
+        self.resize(1000, 700)
+        self.view = QtWebEngineWidgets.QWebEngineView(self)
+        self.setCentralWidget(self.view)
+        self.hover_text = None      # decided by the size of the first poll, before then there is no graph to extend
+        self.polling = False
+
+        # the watcher is only ever used by one poll at a time, on this pool's single thread
+        self.thread_pool = QtCore.QThreadPool(self)
+        self.thread_pool.setMaxThreadCount(1)
+        self.statusBar().showMessage(f"reading the reports already in {watcher.full_path} ...")
+        self.poll()
+
+        self.timer = QtCore.QTimer(self)
+        self.timer.timeout.connect(self.poll)
+        self.timer.start(int(interval * 1000))
+
+    def show_status(self):
+        self.statusBar().showMessage(f"watching {self.watcher.full_path}: {self.watcher.parsed} reports parsed, "
+                                     f"{self.watcher.points} points")
+
+    def poll(self):
+        if self.polling:        # the last poll is still parsing, eg. a long first poll
+            return
+        self.polling = True
+        worker = pollWorker(self.watcher)
+        worker.signals.polled.connect(self.update_graph)
+        worker.signals.error.connect(self.poll_failed)
+        self.thread_pool.start(worker)
+
+    def poll_failed(self, message):
+        self.polling = False
+        self.statusBar().showMessage(f"poll failed: {message}")
+        print(message)
+
+    def draw_graph(self, rows):
+        data = pd.DataFrame(rows, columns=GRAPH_DATA_COLUMNS)
+        self.hover_text = len(data) <= WEBGL_THRESHOLD     # large graphs are drawn without per-point hover text
+        # plotly.js is too large for setHtml, so the page is loaded from a file in the experiment folder
+        html_path = os.path.join(self.watcher.full_path, 'graph_live.html')
+        make_figure(data).write_html(html_path, include_plotlyjs=True)
+        self.view.load(QtCore.QUrl.fromLocalFile(html_path))
+
+    def update_graph(self, rows):
+        self.polling = False
+        if self.hover_text is None:
+            self.draw_graph(rows)
+        elif rows:
+            update = {
+                'x': [[row[2] for row in rows]],
+                'y': [[row[1] for row in rows]],
+                'marker.color': [[row[0] for row in rows]],
+            }
+            if self.hover_text:
+                update['text'] = [[row[3] for row in rows]]
+            self.view.page().runJavaScript(
+                "Plotly.extendTraces(document.getElementsByClassName('plotly-graph-div')[0], "
+                f"{json.dumps(update)}, [0]);"
+            )
+        self.show_status()
+
+    def closeEvent(self, event):
+        self.timer.stop()
+        self.thread_pool.waitForDone()      # a poll that is still running finishes before the watcher is closed
+        self.watcher.close()
+        super(liveGraphGui, self).closeEvent(event)
+
+
+def start():
+    m = graphingGui()
+    m.show()
+    return m
+
+
+def main():
+    app = QtWidgets.QApplication(sys.argv)
+    window = start()
+    app.exec_()
+
+
+if __name__ == '__main__':
+    main()
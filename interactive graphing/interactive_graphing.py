@@ -3,13 +3,23 @@
 
 import plotly.graph_objects as go
 import pandas as pd
+import numpy as np
 import os
 import csv
+import re
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 import aghplctools
 from aghplctools.ingestion import text
 from aghplctools import hplc
-from PyQt5 import QtCore, QtGui, QtWidgets, uic
-from PyQt5.QtCore import QDate, QTime
+from calibration import fit_calibrations, load_calibration_data, overlay_calibration
+from graph_data import GRAPH_DATA_COLUMNS, GraphDataWriter, graph_data_path, load_graph_data
+from level_of_detail import downsample
+from peak_table import PeakTable
+from push_volumes import load_push_volumes, push_volume_at
+from report_cache import ReportCache
+from report_parser import arrays_from_dictionary, parse_report, parse_report_arrays
 
 
 def create_csv_file_path():
@@ -62,14 +72,18 @@ def get_csv_file_path(csv_dir):
     return csv_file_path
 
 
-def get_directory_name(des_date, des_time):
+# todo - determine what the master directory is on the lab computer
+# the HPLC_MASTER_DIRECTORY environment variable points it somewhere else, eg. on an analysis server
+MASTER_DIRECTORY = os.environ.get('HPLC_MASTER_DIRECTORY', '/Users/idavi/OneDrive/Desktop/hein lab/HPLC data/')
+
+
+def get_directory_name(des_date, des_time, master_directory=MASTER_DIRECTORY):
     """
     :param des_date: the date of the experiment, str
     :param des_time: the time of the experiment, str
+    :param master_directory: the folder that holds a folder of experiments for every date
     :return: the path to the master folder through which to parse
     """
-    master_directory = '/Users/idavi/OneDrive/Desktop/hein lab/HPLC data/'
-    # todo - determine what the master directory is on the lab computer
     exp_folder = f"PS_pushramp {des_date} {des_time}"
     path = os.path.join(master_directory, des_date)
     full_path = os.path.join(path, exp_folder)
@@ -87,20 +101,69 @@ def create_text_file(full_path):
     return full_text_file_path
 
 
+def _natural_key(name):
+    """
+    :param name: a file or folder name
+    :return: a sort key that orders the numbers in the name by value, so 'Inj 9' comes before 'Inj 10'
+    """
+    return [int(part) if part.isdigit() else part.lower() for part in re.split(r'(\d+)', name)]
+
+
+def discover_reports(full_path, manifest_path=None, desired_file='Report.TXT'):
+    """
+    :param full_path: the path to the master folder
+    :param manifest_path: the path of a text file to list the reports in once discovery stops, or None; if the
+                          generator is closed early it lists the reports found until then
+    :param desired_file: the name of the report files
+    :return: a generator of the paths to every desired_file, in injection order
+
+    :purpose: walks the experiment folder with os.scandir, sorting each folder naturally so the order is the same on
+              every run. Chemstation writes the report into the top of each .D data folder, so the inside of a .D
+              folder is never walked, and hidden folders are skipped
+    """
+    found = []
+    stack = [full_path]
+    try:
+        while stack:
+            directory = stack.pop()
+            with os.scandir(directory) as entries:
+                entries = sorted(entries, key=lambda entry: _natural_key(entry.name))
+            sub_directories = []
+            for entry in entries:
+                if entry.name.startswith('.'):
+                    continue
+                if entry.is_dir():
+                    if entry.name.upper().endswith('.D'):
+                        complete_name = os.path.join(entry.path, desired_file)
+                        if os.path.isfile(complete_name):
+                            found.append(complete_name)
+                            yield complete_name
+                    else:
+                        sub_directories.append(entry.path)
+                elif entry.name == desired_file:
+                    found.append(entry.path)
+                    yield entry.path
+            stack.extend(reversed(sub_directories))     # depth first, in sorted order
+    finally:
+        # also written when the caller stops early (eg. once every push volume is used, or on cancel) and closes the
+        # generator, so an old manifest is never left behind; the file is swapped in whole
+        if manifest_path is not None:
+            temporary_path = manifest_path + f'.{os.getpid()}.tmp'
+            with open(temporary_path, 'w') as text_file:
+                text_file.writelines(f'{complete_name}\n' for complete_name in found)
+            os.replace(temporary_path, manifest_path)
+
+
 def pywalker(full_path, full_text_file_path):
     """
     :param full_path: the path to the master folder
     :param full_text_file_path: the path of the text file that stores the data
 
-    :purpose: finds all of the instances of desired_file and writes the directories to a text file
+    :purpose: finds all of the instances of desired_file and writes the directories to a text file, replacing its
+              previous contents
     """
-    desired_file = 'Report.TXT'
-    for root, dirs, files in os.walk(full_path):
-        for file_ in files:
-            complete_name = os.path.join(root, file_)
-            if file_ == desired_file:
-                text_file = open(full_text_file_path, 'a')
-                text_file.write(f'{complete_name}\n')
+    for _ in discover_reports(full_path, full_text_file_path):
+        pass
 
 
 def get_retention_time():
@@ -136,6 +199,67 @@ def get_flexibility_time():
             run_again = True
 
 
+# the parser of the Report.TXT files: 'native' (report_parser, checked against aghplctools with
+# report_parser.compare_parsers) or 'aghplctools'
+REPORT_PARSER = 'native'
+
+
+def pull_report(complete_name, parser=REPORT_PARSER, signals=None, arrays=False):
+    """
+    :param complete_name: the path to the Report.TXT file
+    :param parser: 'native' for report_parser.parse_report, or 'aghplctools'; both give the same dictionary
+    :param signals: the wavelengths to pull, None for every signal (only the native parser skips the others)
+    :param arrays: return the {wavelength: SignalArrays} of report_parser instead, which the native parser decodes
+                   straight into arrays
+    :return: the dictionary of {wavelength: {retention time: {Peak, RetTime, Type, Width, Area, Height, Name}}}
+             pulled from the file
+    """
+    if parser == 'native':
+        return parse_report_arrays(complete_name, signals) if arrays else parse_report(complete_name, signals)
+    if parser == 'aghplctools':
+        dictionary = aghplctools.ingestion.text.pull_hplc_area_from_txt(filename=complete_name)
+        return arrays_from_dictionary(dictionary) if arrays else dictionary
+    raise ValueError(f"unknown report parser {parser!r}, use 'native' or 'aghplctools'")
+
+
+def area_from_pulled(dictionary, ret_time, flex_time, signal):
+    """
+    :param dictionary: the dictionary pulled from a Report.TXT file
+    :param ret_time: the retention time in which we are interested, with 3 decimal places
+    :param flex_time: the flexibility to be considered when looking at the retention times
+    :param signal: the wavelength we are interested in
+    :return area: the area associated with that retention time
+    :return actual_ret_time: the actual retention time (ie. the retention time within the bounds)
+    """
+    signal_values = dictionary.get(signal) or {}
+    if len(signal_values) == 0:
+        return 0., None
+    # the peak is chosen once, the closest to the desired retention time (the lower one on a tie), and both the area
+    # and the retention time are read from it, so they always agree at the edges of the window
+    actual_ret_time = min(signal_values.keys(), key=lambda key: (abs(key - ret_time), key))
+    if abs(actual_ret_time - ret_time) > flex_time:
+        return 0., None
+    return signal_values[actual_ret_time]['Area'], actual_ret_time
+
+
+def area_from_arrays(arrays, ret_time, flex_time, signal):
+    """
+    :param arrays: the {wavelength: SignalArrays} pulled from a Report.TXT file
+    :param ret_time: the retention time in which we are interested, with 3 decimal places
+    :param flex_time: the flexibility to be considered when looking at the retention times
+    :param signal: the wavelength we are interested in
+    :return: the same area and actual retention time as area_from_pulled on the dictionary of the report
+    """
+    peaks = arrays.get(signal)
+    if peaks is None or len(peaks.RetTime) == 0:
+        return 0., None
+    # the same single choice of peak as area_from_pulled; argmin takes the first, lower, retention time on a tie
+    nearest = np.abs(peaks.RetTime - ret_time).argmin()
+    if abs(peaks.RetTime[nearest] - ret_time) > flex_time:
+        return 0., None
+    return float(peaks.Area[nearest]), float(peaks.RetTime[nearest])
+
+
 def parse_dict(complete_name, ret_time, flex_time, signal):
     """
     :param complete_name: the path to the file in which we are interested
@@ -145,144 +269,384 @@ def parse_dict(complete_name, ret_time, flex_time, signal):
     :return area: the area associated with that retention time
     :return actual_ret_time: the actual retention time (ie. the retention time within the bounds)
     """
-    dictionary = aghplctools.ingestion.text.pull_hplc_area_from_txt(filename=complete_name)
-    values = aghplctools.hplc.HPLCTarget(wavelength=signal, retention_time=ret_time, wiggle=flex_time).add_from_pulled(dictionary)
-    area = values[0]    # this gets just the area
-    signal_values = dictionary.get(signal)
-    keys = tuple(signal_values.keys())
-    for i in (0, len(keys)-1):
-        upper_bound = ret_time + flex_time
-        lower_bound = ret_time - flex_time
-        if (keys[i] >= lower_bound) & (keys[i] <= upper_bound):
-            actual_ret_time = keys[i]
-            return area, actual_ret_time
-        else:
-            actual_ret_time = None
-            return area, actual_ret_time
+    return area_from_pulled(pull_report(complete_name), ret_time, flex_time, signal)
 
-    # return area, actual_ret_time
 
-
-def write_to_csv(des_date, des_time, des_ret_time, des_flex_time, des_signal, csv_dir):
+def pull_reports(directories, workers=1, cache=None, prefetch=8, parser=REPORT_PARSER, signals=None, arrays=False):
+    """
+    :param directories: the paths to the Report.TXT files, in injection order
+    :param workers: the number of processes to parse with; 1 parses in this process
+    :param cache: a ReportCache of previously pulled reports, or None to parse every file
+    :param prefetch: the number of files queued ahead of the results for each worker process
+    :param parser: the parser of pull_report
+    :param signals: the wavelengths to pull, None for every signal; ignored with a cache, which keeps every signal
+    :param arrays: give the {wavelength: SignalArrays} of each report instead of its dictionary; the reports are only
+                   decoded straight into arrays without a cache, which stores dictionaries
+    :return: a generator of (directory, dictionary), in the same order as directories
+
+    :purpose: spreads the pull_report calls across a process pool while keeping the injection order, only parsing
+              the files that are not already in the cache
+    """
+    executor = ProcessPoolExecutor(max_workers=workers) if workers != 1 else None
+    pending = deque()       # (directory, stat, cached dictionary, future), kept in submission order
+    window = workers * prefetch if executor is not None else 1
+    if cache is not None:
+        signals = None
+
+    parse_arrays = arrays and cache is None
+
+    def resolve():
+        directory, stat, dictionary, future = pending.popleft()
+        if dictionary is None:
+            dictionary = future.result() if future is not None else pull_report(directory, parser, signals,
+                                                                                parse_arrays)
+            if cache is not None:
+                cache.put(directory, dictionary, stat)
+        if arrays and not parse_arrays:
+            dictionary = arrays_from_dictionary(dictionary)
+        return directory, dictionary
+
+    try:
+        for directory in directories:
+            stat = os.stat(directory) if cache is not None else None
+            dictionary = cache.get(directory, stat) if cache is not None else None
+            future = None
+            if dictionary is None and executor is not None:
+                future = executor.submit(pull_report, directory, parser, signals, parse_arrays)
+            pending.append((directory, stat, dictionary, future))
+            if len(pending) >= window:
+                yield resolve()
+        while pending:
+            yield resolve()
+    finally:
+        if executor is not None:
+            # stops the pool from parsing files nobody is waiting for (eg. once the push volumes run out)
+            executor.shutdown(wait=True, cancel_futures=True)
+        if cache is not None:
+            cache.commit()
+
+
+def parse_reports(directories, ret_time, flex_time, signal, workers=1, cache=None, parser=REPORT_PARSER):
+    """
+    :param directories: the paths to the Report.TXT files, in injection order
+    :param ret_time: the retention time in which we are interested, with 3 decimal places
+    :param flex_time: the flexibility to be considered when looking at the retention times
+    :param signal: the wavelength we are interested in
+    :param workers: the number of processes to parse with; 1 parses in this process
+    :param cache: a ReportCache of previously pulled reports, or None to parse every file
+    :param parser: the parser of pull_report
+    :return: a generator of (directory, area, actual_ret_time), in the same order as directories
+    """
+    # without a cache the reports are decoded straight into arrays, a cache keeps the dictionaries it stores
+    arrays = cache is None
+    area_from = area_from_arrays if arrays else area_from_pulled
+    pulled = pull_reports(directories, workers=workers, cache=cache, parser=parser, signals=(signal,), arrays=arrays)
+    try:
+        for directory, dictionary in pulled:
+            yield (directory, *area_from(dictionary, ret_time, flex_time, signal))
+    finally:
+        pulled.close()
+
+
+def build_peak_table(des_date, des_time, workers=1, use_cache=True, master_directory=MASTER_DIRECTORY,
+                     parser=REPORT_PARSER):
+    """
+    :param des_date: the desired date, str
+    :param des_time: the desired time, str
+    :param workers: the number of processes used to parse the Report.TXT files, None uses every core
+    :param use_cache: reuse the peak tables cached in the experiment folder, only parsing new or changed reports
+    :param master_directory: the folder that holds a folder of experiments for every date
+    :param parser: the parser of pull_report
+    :return: a PeakTable of every peak in the experiment, which can answer many (signal, retention time, flex time)
+             targets in one query
+    """
+    full_path = get_directory_name(des_date, des_time, master_directory)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    cache = ReportCache.for_experiment(full_path) if use_cache else None
+    try:
+        return PeakTable.from_pulled(pull_reports(discover_reports(full_path), workers=workers, cache=cache,
+                                                  parser=parser, arrays=cache is None))
+    finally:
+        if cache is not None:
+            cache.close()
+
+
+def write_to_csv(des_date, des_time, des_ret_time, des_flex_time, des_signal, csv_dir, workers=1, use_cache=True, manifest=True,
+                 output_format='csv', progress=None, cancel=None, master_directory=MASTER_DIRECTORY, parser=REPORT_PARSER,
+                 graph_data=None):
     """
     :param des_time: the desired time, str
     :param des_date: the desired date, str
     :param des_ret_time: the desired retention time, float
     :param des_flex_time: the desired flex time, float
     :param des_signal: the desired signal, int
-    :param csv_dir: directory of the CSV file containing the push volumes
-    :return: the directory of the CSV file that contains all of the information we need to graph
+    :param csv_dir: the folder of push_volumes.xlsx (or push_volumes.csv), or the file itself
+    :param workers: the number of processes used to parse the Report.TXT files, None uses every core
+    :param use_cache: reuse the peak tables cached in the experiment folder, only parsing new or changed reports
+    :param manifest: list the reports that were found in the directory_names.txt file of the experiment folder
+    :param output_format: 'csv', or 'parquet'/'arrow' to write a columnar file that loads without parsing text
+    :param progress: called as progress(files parsed, rows matched, total files, elapsed seconds) after every file
+    :param cancel: a threading.Event that stops the ingestion once it is set
+    :param master_directory: the folder that holds a folder of experiments for every date
+    :param parser: the parser of pull_report
+    :param graph_data: the path of the graph data file to write, graph_data.<format> in the experiment folder by default
+    :return: the directory of the file that contains all of the information we need to graph, or None if cancelled
     """
     # constant variables - do not change while in the loop
     # todo - make these inputs external to the method
-    full_path = get_directory_name(des_date, des_time)
-    csv_file_name = full_path + '/graph_data.csv'
-    full_text_file_path = create_text_file(full_path)           # creates a text file in which we store the directory names through which we wish to parse
-    pywalker(full_path, full_text_file_path)                    # populates the text file with the directories
-    push_vol_dir = get_csv_file_path(csv_dir)                     # creates a CSV file & returns the path
-    with open(csv_file_name, 'w', newline='') as csv_file:
-        writer = csv.writer(csv_file, delimiter=",")
-        writer.writerow(["retention time", "area", "push volume", "directory"])
-    with open(push_vol_dir, 'r') as push_vol_file:
-        rows = list(csv.reader(push_vol_file, delimiter=","))
-        push_vol_rows = [val for sublist in rows for val in sublist]    # flatten the list
-    with open(full_text_file_path, 'r') as txt_file:
-        count = 1
-        for line in txt_file:
-            directory = line.strip('\n')
+    full_path = get_directory_name(des_date, des_time, master_directory)
+    csv_file_name = graph_data if graph_data is not None else graph_data_path(full_path, output_format)
+    full_text_file_path = create_text_file(full_path) if manifest else None     # the text file in which we list the directories that were found
+    push_volumes = load_push_volumes(csv_dir)      # the volume of every injection, cached by the workbook's hash
+    if workers is None:
+        workers = os.cpu_count() or 1
+    discovery = discover_reports(full_path, full_text_file_path)
+    directories = discovery     # streams the reports straight into the parser
+    total = None
+    if progress is not None:
+        directories = list(directories)     # the total is needed for the progress, listing is quick next to parsing
+        total = len(directories)
+    start_time = time.perf_counter()
+    parsed = 0
+    matched = 0
+    cache = ReportCache.for_experiment(full_path) if use_cache else None
+    results = None
+    writer = None
+    cancelled = False
+    try:
+        results = parse_reports(directories, des_ret_time, des_flex_time, des_signal, workers=workers, cache=cache,
+                                parser=parser)
+        writer = GraphDataWriter(csv_file_name, output_format)       # keeps the file open, rows are written in batches
+        for directory, area, actual_ret_time in results:
+            if cancel is not None and cancel.is_set():
+                cancelled = True
+                break
+            # the push volume of an injection is found by its position, so an injection without a peak does not shift
+            # the volumes of the ones after it
+            push_vol = push_volume_at(push_volumes, parsed)
+            parsed += 1
             short_dir = directory[49:-25]
-            area, actual_ret_time = parse_dict(directory, des_ret_time, des_flex_time, des_signal)
-            if (area != None) & (actual_ret_time != None):
-                push_vol = int(push_vol_rows[count])
-                count += 1
-                if count >= len(push_vol_rows):
-                    break
-                with open(csv_file_name, 'a', newline='') as csv_file:
-                    # todo - check the condition where the retention time doesn't fall within bounds
-                    # todo - update what part of the directory gets written (interested in day, time + folder)
-                    writer = csv.writer(csv_file, delimiter=",")
-                    # todo - parse the text file with the directories
-                    row = [actual_ret_time, area, push_vol, short_dir]
-                    writer.writerow(row)
+            if (area != None) & (actual_ret_time != None) & (push_vol != None):
+                matched += 1
+                # todo - update what part of the directory gets written (interested in day, time + folder)
+                row = [actual_ret_time, area, push_vol, short_dir]
+                writer.writerow(row)
+            if progress is not None:
+                progress(parsed, matched, total, time.perf_counter() - start_time)
+            if parsed >= len(push_volumes):
+                break       # the injections after the last push volume are not part of the ramp
+    finally:
+        # also run when a report cannot be parsed, so a parquet/Arrow file is never left without its footer and the
+        # process pool and the cache connection are not left open in the GUI's worker thread
+        if results is not None:
+            results.close()
+        discovery.close()
+        if writer is not None:
+            writer.close()
+        if cache is not None:
+            cache.close()
+    elapsed = time.perf_counter() - start_time
+    print(f"parsed {parsed} files in {elapsed:.2f} s ({parsed / max(elapsed, 1e-9):.1f} files/s) using {workers} process(es)")
+    if cache is not None:
+        print(f"report cache: {cache.hits} reused, {cache.misses} parsed")
+    if cancelled:
+        print("ingestion cancelled")
+        return None
     return csv_file_name
 
 
-def graph_stuff(graph_data):
+class ReportWatcher:
     """
-    :param graph_data: the path to the CSV file that contains all of the data we need to graph
-    :return: none
+    polls an experiment folder for new Report.TXT files while a run is still going
+
+    every poll lists the folder with discover_reports, which only costs a scandir per folder, and parses just the
+    reports it has not seen before. a report is only parsed once its size is the same on two polls in a row (or it
+    has not been modified for settle_time seconds), so a report that Chemstation is still writing is never read. the
+    new rows are appended to the graph data CSV and returned so they can be pushed into an open figure
+    """
+
+    def __init__(self, full_path, ret_time, flex_time, signal, push_volumes, graph_data, cache=None, settle_time=10):
+        """
+        :param full_path: the path to the experiment folder
+        :param ret_time: the retention time in which we are interested, with 3 decimal places
+        :param flex_time: the flexibility to be considered when looking at the retention times
+        :param signal: the wavelength we are interested in
+        :param push_volumes: the push volume of each injection, from load_push_volumes
+        :param graph_data: the path of the graph data CSV file, its contents are replaced
+        :param cache: a ReportCache of previously pulled reports, or None to parse every file
+        :param settle_time: the number of seconds after which an unmodified report is known to be complete
+        """
+        self.full_path = full_path
+        self.ret_time = ret_time
+        self.flex_time = flex_time
+        self.signal = signal
+        self.push_volumes = push_volumes
+        self.graph_data = graph_data
+        self.cache = cache
+        self.settle_time = settle_time
+        self.parsed = 0             # also the index of the next injection, since reports are parsed in injection order
+        self.points = 0
+        self._done = set()          # the reports that have been parsed
+        self._sizes = {}            # the size each waiting report had on the last poll
+        self._unreturned = []       # the rows written by a poll that then failed
+        self._file = open(graph_data, 'w', newline='')
+        self._writer = csv.writer(self._file, delimiter=",")
+        self._writer.writerow(GRAPH_DATA_COLUMNS)
+        self._file.flush()
+
+    def poll(self):
+        """
+        :return: the rows (retention time, area, push volume, directory) of the reports that appeared since the last poll
+
+        a report that cannot be parsed (eg. a blank injection, 'No peaks found') is skipped with a message but still
+        counts as an injection, so the push volumes of the reports after it stay aligned; the rows gathered before
+        any other error are still written, and given by the next poll
+        """
+        new_rows = []
+        waiting = False
+        try:
+            for directory in discover_reports(self.full_path):
+                if directory in self._done:
+                    continue
+                try:
+                    stat = os.stat(directory)
+                except FileNotFoundError:
+                    waiting = True
+                    continue
+                settled = (self._sizes.get(directory) == stat.st_size) | \
+                    (time.time() - stat.st_mtime > self.settle_time)
+                if waiting or not settled:
+                    # still being written; the reports after it wait as well so the injection order is kept
+                    self._sizes[directory] = stat.st_size
+                    waiting = True
+                    continue
+                self._sizes.pop(directory, None)
+                push_vol = push_volume_at(self.push_volumes, self.parsed)
+                try:
+                    dictionary = self.cache.get(directory, stat) if self.cache is not None else None
+                    if dictionary is None:
+                        dictionary = pull_report(directory)
+                        if self.cache is not None:
+                            self.cache.put(directory, dictionary, stat)
+                except (ValueError, KeyError) as error:
+                    print(f'skipped {directory}: {error}')
+                    dictionary = None
+                self._done.add(directory)
+                self.parsed += 1
+                if dictionary is None:
+                    continue
+                area, actual_ret_time = area_from_pulled(dictionary, self.ret_time, self.flex_time, self.signal)
+                if (area != None) & (actual_ret_time != None) & (push_vol != None):
+                    self.points += 1
+                    new_rows.append([actual_ret_time, area, push_vol, directory[49:-25]])
+        finally:
+            if new_rows:
+                self._writer.writerows(new_rows)
+                self._file.flush()
+            if self.cache is not None:
+                self.cache.commit()
+            self._unreturned.extend(new_rows)
+        rows, self._unreturned = self._unreturned, []
+        return rows
+
+    def close(self):
+        self._file.close()
+        if self.cache is not None:
+            self.cache.close()
+
+
+WEBGL_THRESHOLD = 20000     # above this many points the graph is drawn with WebGL and without per-point hover text
+
+
+def make_figure(data, webgl_threshold=WEBGL_THRESHOLD, max_points=None, downsample_method='minmax'):
+    """
+    :param data: a DataFrame with the graph data columns
+    :param webgl_threshold: the number of points above which Scattergl is used instead of an SVG Scatter
+    :param max_points: the number of points to downsample to for large data, or None to draw every point
+    :param downsample_method: 'minmax' (lowest and highest area per push volume bin, and per area cell within it when
+                              there are few push volumes) or 'lttb'
+    :return: the plotly figure of area against push volume
     """
-    data = pd.read_csv(graph_data)
+    if max_points is not None and len(data) > max_points:
+        data = data.iloc[downsample(data['push volume'], data['area'], max_points, downsample_method)]
+    large = len(data) > webgl_threshold
+    scatter = go.Scattergl if large else go.Scatter
+    if large:
+        # the directories are left out of the page, they are only sent once the view is zoomed in (see
+        # level_of_detail_widget)
+        hover = dict(hovertemplate='push volume: %{x}<br>area: %{y}<br>retention time: %{marker.color}<extra></extra>')
+    else:
+        hover = dict(text=data['directory'])  # hover text goes here - will be the directory or the timestamp of the experiment
     # todo - add units
-    fig = go.Figure(data=go.Scatter(x=data['push volume'],  # this will be push volume
-                                    y=data['area'],  # this will be the area
-                                    mode='markers',
-                                    marker_color=data['retention time'],
-                                    text=data[
-                                        'directory']))  # hover text goes here - will be the directory or the timestamp of the experiment
+    fig = go.Figure(data=scatter(x=data['push volume'],  # this will be push volume
+                                 y=data['area'],  # this will be the area
+                                 mode='markers',
+                                 marker_color=data['retention time'],
+                                 **hover))
     fig.update_layout(title='HPLC Graph')
-    fig.show()
-
-# GUI stuff below
+    return fig
 
 
-class graphingGui(QtWidgets.QMainWindow):
-    def __init__(self, parent=None):
-        super(graphingGui, self).__init__()
-        uic.loadUi('graph_gui.ui', self)
-
-        self.okButton = self.findChild(QtWidgets.QPushButton, 'okButton')
-        self.okButton.clicked.connect(self.ok_button_pressed)
-        self.okButton.clicked.connect(self.close)
-
-        self.cancelButton = self.findChild(QtWidgets.QPushButton, 'cancelButton')
-        self.cancelButton.clicked.connect(self.close)
-
-    def ok_button_pressed(self):
-        # getting the date
-        raw_date = self.dateEdit.date()             # type str
-        des_date = str(QDate.toPyDate(raw_date))
-        print("desired date:", des_date)
-
-        # getting the time
-        raw_time = self.timeEdit.time()             # type str
-        str_time = str(QTime.toPyTime(raw_time))
-        seg_1 = str_time[0:2]
-        seg_2 = str_time[3:5]
-        seg_3 = str_time[6:]
-        des_time = seg_1 + '-' + seg_2 + '-' + seg_3
-        print("desired time:", des_time)
-
-        # getting the ret_time
-        ret_time = float(self.retTimeBox.text())    # type float
-        print("ret time:", ret_time)
-
-        # getting the flex_time
-        flex_time = float(self.flexTimeBox.text())  # type float
-        print("flex time:", flex_time)
-
-        # getting the directory
-        directory = self.directoryLineEdit.text()   # type str
-        print("directory:", directory)
-
-        # getting the signal
-        sig = self.signalComboBox.currentText()     # type str
-        des_sig = int(sig[0:3])
-        print("signal:", sig)
-        print("des_sig:", des_sig)
-
-        graph_data = write_to_csv(des_date, des_time, ret_time, flex_time, des_sig, directory)
-        graph_stuff(graph_data)
+def level_of_detail_widget(data, max_points=5000, downsample_method='minmax'):
+    """
+    :param data: a DataFrame with the graph data columns
+    :param max_points: the number of points drawn at any zoom level
+    :param downsample_method: 'minmax' or 'lttb'
+    :return: a plotly FigureWidget (for Jupyter) that draws a downsampled overview and resamples the full data every
+             time the view is zoomed or panned, so the exact points and their directories show once few enough are in view
+    """
+    push_volume = data['push volume'].to_numpy(dtype=float)
+    area = data['area'].to_numpy(dtype=float)
+    fig = go.FigureWidget(make_figure(data, max_points=max_points, downsample_method=downsample_method))
+
+    def resample(layout, x_range, y_range):
+        in_view = np.ones(len(data), dtype=bool)
+        if x_range is not None:
+            in_view &= (push_volume >= min(x_range)) & (push_volume <= max(x_range))
+        if y_range is not None:
+            in_view &= (area >= min(y_range)) & (area <= max(y_range))
+        view = data[in_view]
+        if len(view) > max_points:
+            view = view.iloc[downsample(view['push volume'], view['area'], max_points, downsample_method)]
+        with fig.batch_update():
+            trace = fig.data[0]
+            trace.x = view['push volume']
+            trace.y = view['area']
+            trace.marker.color = view['retention time']
+            trace.text = view['directory'] if len(view) <= WEBGL_THRESHOLD else None
+
+    fig.layout.on_change(resample, 'xaxis.range', 'yaxis.range')
+    return fig
+
+
+def graph_stuff(graph_data, max_points=None, downsample_method='minmax', calibrate=False):
+    """
+    :param graph_data: the path to the CSV, parquet or Arrow file that contains all of the data we need to graph
+    :param max_points: the number of points to downsample to for large data, or None to draw every point
+    :param downsample_method: 'minmax' or 'lttb'
+    :param calibrate: whether to fit the calibration line, overlay it and its outliers and print its summary
+    :return: none
+    """
+    if not calibrate:
+        data = load_graph_data(graph_data)
+        fig = make_figure(data, max_points=max_points, downsample_method=downsample_method)
+    else:
+        summary, data = fit_calibrations(load_calibration_data([graph_data]))
+        fig = overlay_calibration(make_figure(data, max_points=max_points, downsample_method=downsample_method),
+                                  summary, data)
+        print(summary.drop(columns='curve').T.to_string(header=False))
+    fig.show()
 
 
 def start():
-    m = graphingGui()
-    m.show()
-    return m
+    """
+    :return: the main window of the GUI, which lives in graphing_gui so that Qt is only imported when it is needed
+    """
+    import graphing_gui
+    return graphing_gui.start()
 
 
 if __name__ == '__main__':
-    import sys
-    app = QtWidgets.QApplication(sys.argv)
-    window = start()
-    app.exec_()
+    import graphing_gui
+    graphing_gui.main()
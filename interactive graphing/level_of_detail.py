@@ -0,0 +1,112 @@
+# author: Ioana David
+
+import numpy as np
+
+
+def downsample_minmax(x, y, n_points):
+    """
+    :param x: the x values, array
+    :param y: the y values, array
+    :param n_points: the number of points to keep, about
+    :return: the sorted indices of the points to keep: the lowest and highest y of every x bin, so the outline of the
+             data (and any outliers) still shows; when x only takes a few values (eg. push volumes) and so fills fewer
+             bins than asked for, each x bin is also split into y cells over its own range of y, so the spread of y at
+             each x is kept and about n_points points are still returned
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    if len(x) <= n_points:
+        return np.arange(len(x))
+    n_bins = max(n_points // 2, 1)
+    order = np.argsort(x, kind='stable')
+    ends_of_x = order[[0, -1]]
+    x_sorted = x[order]
+    low, high = x_sorted[0], x_sorted[-1]
+    if high == low:
+        bins = np.zeros(len(x), dtype=np.int64)
+    else:
+        bins = np.minimum(((x_sorted - low) / (high - low) * n_bins).astype(np.int64), n_bins - 1)
+    starts = np.flatnonzero(np.r_[True, bins[1:] != bins[:-1]])
+    n_cells = n_bins // len(starts)
+    if n_cells > 1:
+        y_sorted = y[order]
+        segment = np.repeat(np.arange(len(starts)), np.diff(np.r_[starts, len(bins)]))
+        y_low = np.minimum.reduceat(y_sorted, starts)[segment]
+        y_span = np.maximum.reduceat(y_sorted, starts)[segment] - y_low
+        spread = y_span > 0
+        cell = np.zeros(len(bins), dtype=np.int64)
+        cell[spread] = np.minimum(((y_sorted[spread] - y_low[spread]) / y_span[spread] * n_cells).astype(np.int64),
+                                  n_cells - 1)
+        bins = segment * n_cells + cell
+        regroup = np.argsort(bins, kind='stable')
+        order, bins = order[regroup], bins[regroup]
+        starts = np.flatnonzero(np.r_[True, bins[1:] != bins[:-1]])
+    y_sorted = y[order]
+    bin_min = starts + _argreduce(y_sorted, starts, np.minimum)
+    bin_max = starts + _argreduce(y_sorted, starts, np.maximum)
+    keep = np.unique(np.concatenate([bin_min, bin_max]))
+    return np.unique(np.concatenate([order[keep], ends_of_x]))
+
+
+def _argreduce(values, starts, ufunc):
+    """
+    :return: the offset from the start of each segment to its smallest (np.minimum) or largest (np.maximum) value
+    """
+    reduced = ufunc.reduceat(values, starts)
+    segment = np.repeat(np.arange(len(starts)), np.diff(np.r_[starts, len(values)]))
+    position = np.arange(len(values)) - starts[segment]
+    hits = values == reduced[segment]
+    # the first position in each segment that holds the reduced value
+    first = np.full(len(starts), len(values))
+    np.minimum.at(first, segment[hits], position[hits])
+    return first
+
+
+def downsample_lttb(x, y, n_points):
+    """
+    :param x: the x values, array
+    :param y: the y values, array
+    :param n_points: the number of points to keep
+    :return: the sorted indices of the points picked by largest-triangle-three-buckets, which keeps the points that
+             change the shape of the data the most
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    n = len(x)
+    if n <= n_points or n_points < 3:
+        return np.arange(n)
+    order = np.argsort(x, kind='stable')
+    xs, ys = x[order], y[order]
+    edges = np.linspace(1, n - 1, n_points - 1).astype(np.int64)     # n_points - 2 buckets between the end points
+    selected = np.empty(n_points, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    previous = 0
+    for bucket in range(n_points - 2):
+        start, end = edges[bucket], max(edges[bucket + 1], edges[bucket] + 1)
+        # the average of the next bucket is the third corner of the triangle
+        next_start, next_end = end, (edges[bucket + 2] if bucket + 2 < len(edges) else n)
+        next_end = max(next_end, next_start + 1)
+        average_x = xs[next_start:next_end].mean()
+        average_y = ys[next_start:next_end].mean()
+        area = np.abs((xs[previous] - average_x) * (ys[start:end] - ys[previous])
+                      - (xs[previous] - xs[start:end]) * (average_y - ys[previous]))
+        previous = start + int(np.argmax(area))
+        selected[bucket + 1] = previous
+    return np.sort(order[np.unique(selected)])
+
+
+DOWNSAMPLERS = {'minmax': downsample_minmax, 'lttb': downsample_lttb}
+
+
+def downsample(x, y, n_points, method='minmax'):
+    """
+    :param x: the x values, array
+    :param y: the y values, array
+    :param n_points: the number of points to keep
+    :param method: 'minmax' or 'lttb'
+    :return: the sorted indices of the points to keep
+    """
+    if method not in DOWNSAMPLERS:
+        raise ValueError(f"unknown downsampling method {method!r}, expected one of {list(DOWNSAMPLERS)}")
+    return DOWNSAMPLERS[method](x, y, n_points)
@@ -0,0 +1,159 @@
+# author: Ioana David
+
+import numpy as np
+import pandas as pd
+
+
+class PeakTable:
+    """
+    the peaks of every injection in an experiment, stored as columns of NumPy arrays
+
+    the rows are sorted by wavelength, then injection, then retention time, so that the peaks that fall within a
+    retention time window can be found for every injection at once with np.searchsorted instead of looping through the
+    pulled dictionaries
+    """
+
+    def __init__(self, injection, wavelength, retention_time, area, directories):
+        """
+        :param injection: the index of the injection each peak belongs to, int array
+        :param wavelength: the signal each peak was measured at, float array
+        :param retention_time: the retention time of each peak, float array
+        :param area: the area of each peak, float array
+        :param directories: the path to the report of each injection, in injection order
+        """
+        injection = np.asarray(injection, dtype=np.int64)
+        wavelength = np.asarray(wavelength, dtype=np.float64)
+        retention_time = np.asarray(retention_time, dtype=np.float64)
+        area = np.asarray(area, dtype=np.float64)
+        self.directories = list(directories)
+        self.wavelengths = np.unique(wavelength)
+        order = np.lexsort((retention_time, injection, wavelength))
+        self.injection = injection[order]
+        self.wavelength = wavelength[order]
+        self.retention_time = retention_time[order]
+        self.area = area[order]
+        # every (wavelength, injection) pair gets its own block of the sort key that is one span wide, and the
+        # retention time is the offset within the block
+        self._rt_min = self.retention_time.min() if len(self.retention_time) else 0.0
+        self._span = (self.retention_time.max() - self._rt_min + 1.0) if len(self.retention_time) else 1.0
+        wavelength_code = np.searchsorted(self.wavelengths, self.wavelength)
+        self._key = self._block(wavelength_code, self.injection) + (self.retention_time - self._rt_min)
+
+    @classmethod
+    def from_pulled(cls, pulled):
+        """
+        :param pulled: an iterable of (directory, dictionary) from pull_reports, in injection order, the dictionary
+                       being either {wavelength: {retention time: peak}} or the {wavelength: SignalArrays} of
+                       pull_reports(..., arrays=True)
+        :return: a PeakTable of every peak in the dictionaries
+        """
+        directories = []
+        injection, wavelength, retention_time, area = [], [], [], []
+        for index, (directory, dictionary) in enumerate(pulled):
+            directories.append(directory)
+            for signal, peaks in dictionary.items():
+                if isinstance(peaks, dict):
+                    count = len(peaks)
+                    retention_time.append(np.fromiter(peaks.keys(), dtype=np.float64, count=count))
+                    area.append(np.fromiter((peak['Area'] for peak in peaks.values()), dtype=np.float64, count=count))
+                else:
+                    count = len(peaks.RetTime)
+                    retention_time.append(peaks.RetTime)
+                    area.append(peaks.Area)
+                injection.append(np.full(count, index, dtype=np.int64))
+                wavelength.append(np.full(count, signal, dtype=np.float64))
+        if not injection:
+            return cls([], [], [], [], directories)
+        return cls(np.concatenate(injection), np.concatenate(wavelength), np.concatenate(retention_time),
+                   np.concatenate(area), directories)
+
+    def __len__(self):
+        return len(self.directories)
+
+    def _block(self, wavelength_code, injection):
+        return (wavelength_code * len(self.directories) + injection) * self._span
+
+    def query(self, targets):
+        """
+        :param targets: a list of (signal, retention time, flex time) tuples
+        :return area: an array of shape (targets, injections) of the area of the peak closest to each target
+                      retention time within the flex time, NaN where there is no such peak
+        :return actual_ret_time: an array of the same shape with the retention times of those peaks
+        """
+        targets = np.asarray(targets, dtype=np.float64).reshape(-1, 3)
+        n_injections = len(self.directories)
+        area = np.full((len(targets), n_injections), np.nan)
+        actual_ret_time = np.full((len(targets), n_injections), np.nan)
+        if len(self._key) == 0 or n_injections == 0:
+            return area, actual_ret_time
+        signal, ret_time, flex_time = targets[:, 0:1], targets[:, 1:2], targets[:, 2:3]
+        wavelength_code = np.searchsorted(self.wavelengths, signal)
+        wavelength_code = np.minimum(wavelength_code, len(self.wavelengths) - 1)
+        known = self.wavelengths[wavelength_code] == signal       # shape (targets, 1), an exact match like .get
+        injection = np.arange(n_injections)[np.newaxis, :]
+        block = self._block(wavelength_code, injection)
+        # the centre is clipped to its own block so it can never land among the peaks of the next injection
+        centre = block + np.clip(ret_time - self._rt_min, -0.25, self._span - 0.75)
+        after = np.searchsorted(self._key, centre, side='left')
+        # the closest peak is next to where the target retention time falls; the two peaks on either side are all
+        # looked at so that a peak whose key rounded to the other side of the centre is not missed
+        last = len(self._key) - 1
+        candidates = after[np.newaxis] + np.arange(-2, 2).reshape(-1, 1, 1)
+        index = np.clip(candidates, 0, last)
+        same_block = (candidates >= 0) & (candidates <= last) & (self.injection[index] == injection) & \
+            (self.wavelength[index] == self.wavelengths[wavelength_code])
+        distance = np.where(same_block, np.abs(self.retention_time[index] - ret_time), np.inf)
+        # argmin takes the first, lower, retention time on a tie, like area_from_pulled
+        choice = distance.argmin(axis=0)
+        closest = np.take_along_axis(index, choice[np.newaxis], axis=0)[0]
+        # the peak is then kept with the same test as area_from_pulled, so the two agree at the edges of the window
+        found = (np.take_along_axis(distance, choice[np.newaxis], axis=0)[0] <= flex_time) & known
+        area[found] = self.area[closest][found]
+        actual_ret_time[found] = self.retention_time[closest][found]
+        return area, actual_ret_time
+
+    def to_frame(self, targets):
+        """
+        :param targets: a list of (signal, retention time, flex time) tuples
+        :return: a long DataFrame with one row for every target found in every injection
+        """
+        area, actual_ret_time = self.query(targets)
+        targets = np.asarray(targets, dtype=np.float64).reshape(-1, 3)
+        target_index, injection = np.nonzero(~np.isnan(area))
+        return pd.DataFrame({
+            'signal': targets[target_index, 0],
+            'target retention time': targets[target_index, 1],
+            'injection': injection,
+            'retention time': actual_ret_time[target_index, injection],
+            'area': area[target_index, injection],
+            'directory': [self.directories[i] for i in injection],
+        })
+
+
+def compare_with_pulled(pulled, targets):
+    """
+    :param pulled: an iterable of (directory, dictionary) from pull_reports, in injection order, checked against
+                   area_from_arrays when the dictionaries are arrays
+    :param targets: a list of (signal, retention time, flex time) tuples
+    :return: a list of (directory, target, expected, actual) of every injection where PeakTable.query disagrees with
+             area_from_pulled, expected and actual being (area, retention time) with None where no peak was found
+
+    :purpose: the check of PeakTable against the per-report lookup it replaces, run on the dictionaries the parser
+              really gives rather than on hand built ones
+    """
+    from interactive_graphing import area_from_arrays, area_from_pulled     # interactive_graphing imports this module
+    pulled = list(pulled)
+    area_from = area_from_pulled if all(isinstance(peaks, dict) for _, dictionary in pulled
+                                        for peaks in dictionary.values()) else area_from_arrays
+    area, actual_ret_time = PeakTable.from_pulled(pulled).query(targets)
+    mismatches = []
+    for target_index, target in enumerate(targets):
+        signal, ret_time, flex_time = target
+        for index, (directory, dictionary) in enumerate(pulled):
+            expected_area, expected_ret_time = area_from(dictionary, ret_time, flex_time, signal)
+            expected = (expected_area, expected_ret_time) if expected_ret_time is not None else (None, None)
+            actual = (None, None) if np.isnan(area[target_index, index]) else \
+                (float(area[target_index, index]), float(actual_ret_time[target_index, index]))
+            if expected != actual:
+                mismatches.append((directory, target, expected, actual))
+    return mismatches
@@ -0,0 +1,96 @@
+# author: Ioana David
+# loads the push volume of every injection from push_volumes.xlsx (or push_volumes.csv), caching the parsed volumes
+# as a .npy array keyed by the content hash of the workbook so Excel is only parsed once per version of the file
+
+import hashlib
+import os
+import numpy as np
+import pandas as pd
+
+
+PUSH_VOLUME_FILES = ('push_volumes.xlsx', 'push_volumes.xls', 'push_volumes.csv')
+CACHE_FOLDER_NAME = '.push_volume_cache'
+
+
+def find_push_volume_file(directory):
+    """
+    :param directory: a push volume file, or the folder that holds one
+    :return: the path to the push volume file, the workbook being preferred over a CSV copy of it
+    """
+    if os.path.isfile(directory):
+        return directory
+    for name in PUSH_VOLUME_FILES:
+        path = os.path.join(directory, name)
+        if os.path.isfile(path):
+            return path
+    raise FileNotFoundError(f"none of {list(PUSH_VOLUME_FILES)} are in {directory}")
+
+
+def content_hash(path, chunk_size=2 ** 20):
+    """
+    :return: the sha256 hex digest of the contents of a file
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def read_push_volume_column(path, column=0, sheet_name=0):
+    """
+    :param path: the path to the .xlsx, .xls or .csv file
+    :param column: the header or position of the push volume column
+    :param sheet_name: the sheet of a workbook that holds the push volumes
+    :return: the push volumes as a float array, the header row left out and the empty cells at the end dropped
+    """
+    usecols = [column]
+    if os.path.splitext(path)[1].lower() == '.csv':
+        data = pd.read_csv(path, usecols=usecols)
+    else:
+        data = pd.read_excel(path, sheet_name=sheet_name, usecols=usecols)
+    volumes = pd.to_numeric(data.iloc[:, 0], errors='coerce').to_numpy(dtype=np.float64)
+    filled = np.flatnonzero(~np.isnan(volumes))
+    return volumes[:filled[-1] + 1] if len(filled) else volumes[:0]
+
+
+def load_push_volumes(directory, column=0, sheet_name=0, cache_dir=None):
+    """
+    :param directory: a push volume file, or the folder that holds one
+    :param column: the header or position of the push volume column
+    :param sheet_name: the sheet of a workbook that holds the push volumes
+    :param cache_dir: the folder of the cached arrays, a .push_volume_cache folder next to the file by default
+    :return: a float array of the push volume of each injection, in injection order (NaN for an empty cell)
+
+    :purpose: parses the file only when its contents have not been seen before; an edited workbook gets a new hash,
+              so an out of date array is never used
+    """
+    path = find_push_volume_file(directory)
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(path)), CACHE_FOLDER_NAME)
+    cache_path = os.path.join(cache_dir, f"{content_hash(path)}_{sheet_name}_{column}.npy")
+    if os.path.exists(cache_path):
+        return np.load(cache_path)
+    volumes = read_push_volume_column(path, column, sheet_name)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        temporary_path = cache_path + f'.{os.getpid()}.tmp'
+        with open(temporary_path, 'wb') as cache_file:
+            np.save(cache_file, volumes)
+        os.replace(temporary_path, cache_path)      # another process never sees half an array
+    except OSError as error:        # eg. a read-only share, the volumes are still returned
+        print(f"could not cache the push volumes of {path}: {error}")
+    return volumes
+
+
+def push_volume_at(volumes, injection):
+    """
+    :param volumes: the array from load_push_volumes
+    :param injection: the index of the injection, from 0
+    :return: the push volume of the injection (an int when it is a whole number, as in the graph data), or None if
+             there is none
+    """
+    if injection >= len(volumes) or np.isnan(volumes[injection]):
+        return None
+    volume = float(volumes[injection])
+    return int(volume) if volume.is_integer() else volume
@@ -0,0 +1,124 @@
+# author: Ioana David
+
+import json
+import os
+import sqlite3
+import time
+
+
+CACHE_FILE_NAME = 'report_cache.sqlite'
+
+
+class ReportCache:
+    """
+    an on-disk cache of the peak tables pulled from Report.TXT files
+
+    entries are keyed by the path of the report together with its size and modification time, so a report that has
+    been changed or replaced is parsed again. the cache belongs to one experiment, so it is bounded by age rather than
+    by a count that a single long experiment could exceed: entries that have not been used for max_age seconds (eg.
+    reports that were deleted or moved) are evicted, which keeps it from growing forever on the shared drive. an
+    entry stored or read since the cache was opened is never evicted
+    """
+
+    def __init__(self, cache_path, max_age=30 * 24 * 3600, max_reports=None, check_same_thread=True):
+        """
+        :param cache_path: the path to the SQLite file, created if it does not exist
+        :param max_age: the number of seconds an entry is kept without being used, None to keep every entry
+        :param max_reports: None, or the number of reports to keep before the least recently used are evicted; the
+                            entries of the current run are kept even above it
+        :param check_same_thread: False lets another thread use the cache, as long as only one uses it at a time (eg.
+                                  the polls of a live graph, which run on a thread pool)
+        """
+        self.cache_path = cache_path
+        self.max_age = max_age
+        self.max_reports = max_reports
+        self._opened = time.time()      # the entries used since then belong to the current run
+        self.hits = 0
+        self.misses = 0
+        self._used = []         # paths read since the last commit, their last_used time is updated in one go
+        self._connection = sqlite3.connect(cache_path, check_same_thread=check_same_thread)
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS reports ('
+            'path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, last_used REAL, peaks TEXT)'
+        )
+        self._connection.commit()
+
+    @classmethod
+    def for_experiment(cls, full_path, **kwargs):
+        """
+        :param full_path: the path to the experiment folder
+        :return: the cache stored in the experiment folder
+        """
+        return cls(os.path.join(full_path, CACHE_FILE_NAME), **kwargs)
+
+    def get(self, complete_name, stat=None):
+        """
+        :param complete_name: the path to the Report.TXT file
+        :param stat: the os.stat result of the file, if it is already known
+        :return: the pulled dictionary of {wavelength: {retention time: peak}}, or None if it has to be parsed
+        """
+        if stat is None:
+            stat = os.stat(complete_name)
+        row = self._connection.execute(
+            'SELECT size, mtime_ns, peaks FROM reports WHERE path = ?', (complete_name,)
+        ).fetchone()
+        if row is None or row[0] != stat.st_size or row[1] != stat.st_mtime_ns:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._used.append(complete_name)
+        return {wavelength: dict(peaks) for wavelength, peaks in json.loads(row[2])}
+
+    def put(self, complete_name, dictionary, stat=None):
+        """
+        :param complete_name: the path to the Report.TXT file
+        :param dictionary: the pulled dictionary of {wavelength: {retention time: peak}}
+        :param stat: the os.stat result of the file when it was parsed
+        """
+        if stat is None:
+            stat = os.stat(complete_name)
+        # stored as lists of pairs so the float keys survive the round trip through JSON
+        peaks = json.dumps([[wavelength, list(values.items())] for wavelength, values in dictionary.items()])
+        self._connection.execute(
+            'INSERT OR REPLACE INTO reports (path, size, mtime_ns, last_used, peaks) VALUES (?, ?, ?, ?, ?)',
+            (complete_name, stat.st_size, stat.st_mtime_ns, time.time(), peaks)
+        )
+
+    def evict(self):
+        """
+        :purpose: removes the reports that have not been used for max_age seconds, then the least recently used ones
+                  while there are more than max_reports; the reports used since the cache was opened are kept
+        """
+        if self.max_age is not None:
+            self._connection.execute(
+                'DELETE FROM reports WHERE last_used < ?', (min(time.time() - self.max_age, self._opened),)
+            )
+        if self.max_reports is None:
+            return
+        count = self._connection.execute('SELECT COUNT(*) FROM reports').fetchone()[0]
+        if count > self.max_reports:
+            self._connection.execute(
+                'DELETE FROM reports WHERE path IN '
+                '(SELECT path FROM reports WHERE last_used < ? ORDER BY last_used LIMIT ?)',
+                (self._opened, count - self.max_reports)
+            )
+
+    def commit(self):
+        """
+        :purpose: writes the new entries and last used times to disk, evicting old entries if needed
+        """
+        now = time.time()
+        self._connection.executemany('UPDATE reports SET last_used = ? WHERE path = ?', [(now, path) for path in self._used])
+        self._used.clear()
+        self.evict()
+        self._connection.commit()
+
+    def close(self):
+        self.commit()
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
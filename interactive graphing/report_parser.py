@@ -0,0 +1,344 @@
+# author: Ioana David
+# a fast parser for Chemstation Report.TXT files, giving the same dictionary as
+# aghplctools.ingestion.text.pull_hplc_area_from_txt while only decoding the peak tables of the signals that are needed,
+# or the peak tables as compact NumPy arrays without a dictionary per peak
+
+import codecs
+import re
+from collections import namedtuple
+import numpy as np
+
+
+# the columns of a peak table, in the order aghplctools fills them in; a column missing from a report is None
+PEAK_COLUMNS = ('Peak', 'RetTime', 'Type', 'Width', 'Area', 'Height', 'Name')
+TEXT_COLUMNS = ('Type', 'Name')     # the columns that are only numbers by accident
+# the regex of every (header, unit) pair of a peak table; lines are matched one at a time with re.MULTILINE, so the
+# peak name can hold any whitespace but a line break
+COLUMN_PATTERNS = {
+    ('Peak', '#'): r'[ ]+(?P<Peak>[\d]+)',
+    ('RetTime', '[min]'): r'(?P<RetTime>[\d]+.[\d]+)',
+    ('Type', ''): r'(?P<Type>[A-Z]{1,3}(?: [A-Z]{1,3})*)',
+    ('Width', '[min]'): r'(?P<Width>[\d]+.[\d]+[e+-]*[\d]+)',
+    ('Area', '[mAU*s]'): r'(?P<Area>[\d]+.[\d]+[e+-]*[\d]+)',
+    ('Area', '%'): r'(?P<percent>[\d]+.[\d]+[e+-]*[\d]+)',
+    ('Height', '[mAU]'): r'(?P<Height>[\d]+.[\d]+[e+-]*[\d]+)',
+    ('Name', ''): r'(?P<Name>[^\s]+(?:[^\S\n][^\s]+)*)',
+}
+NUMBER_COLUMNS = tuple(column for column in PEAK_COLUMNS if column not in TEXT_COLUMNS)
+# the numeric columns of the peak table of one signal as float64 arrays, sorted by retention time (NaN for a column the
+# report does not have)
+SignalArrays = namedtuple('SignalArrays', NUMBER_COLUMNS)
+BOMS = (
+    (codecs.BOM_UTF32_LE, 'utf-32'),        # checked before UTF-16 LE, which it starts with
+    (codecs.BOM_UTF32_BE, 'utf-32'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+)
+
+_area_report_re = re.compile(r'[ ]+Area Percent Report')
+_signal_re = re.compile(r'Signal \d: ')
+_signal_info_re = re.compile(
+    r'(?P<signal>[A-Z0-9 ]+ \w), '
+    r'Sig=(?P<wavelength>[\d]+),[\d]* '
+    r'Ref=(?P<reference>[\w]+),*[\d]*'
+    r'(?P<error>[a-z]*)*\n\n'
+)
+_value_re = re.compile(r'[ ]*(?P<value>[^\s]+)[ ]*')
+_peak_patterns = {}     # (header line, unit line, dash line) -> compiled peak regex, most reports share one layout
+
+
+def detect_encoding(data):
+    """
+    :param data: the first bytes of a report
+    :return: the encoding of the report, from its byte order mark; without one, UTF-16 if every other byte is a NUL
+             (Chemstation writes UTF-16), otherwise UTF-8 if the bytes decode as UTF-8, otherwise cp1252
+    """
+    for bom, encoding in BOMS:
+        if data.startswith(bom):
+            return encoding
+    sample = data[:4096]
+    if len(sample) >= 2 and sample[1::2].count(0) > len(sample) // 4:
+        return 'utf-16-le'
+    if len(sample) >= 2 and sample[0::2].count(0) > len(sample) // 4:
+        return 'utf-16-be'
+    try:
+        sample.decode('utf-8')
+    except UnicodeDecodeError as error:
+        if error.start < len(sample) - 3:       # not just a character cut in half at the end of the sample
+            return 'cp1252'
+    return 'utf-8'
+
+
+def read_report_text(complete_name):
+    """
+    :param complete_name: the path to the Report.TXT file
+    :return: the text of the report with every line ending turned into a newline, as open() in text mode gives it
+
+    :purpose: one bulk read and one decode of the whole file; the 'No peaks found' check needs all of the text, and
+              UTF-16 cannot be searched as bytes, so mapping the file would not save any of the decoding
+    """
+    with open(complete_name, 'rb') as report:
+        data = report.read()
+    text = codecs.decode(data, detect_encoding(data[:4096]))
+    if '\r' in text:
+        text = text.replace('\r\n', '\n').replace('\r', '\n')
+    return text
+
+
+def _chunks(line, widths):
+    """
+    :param line: the header or unit line of a peak table
+    :param widths: the width of each column, from the dash line under the units
+    :return: a generator of the stripped value of each column; the columns past the end of the line are empty, and
+             so is one extra column for each of them, the same way aghplctools splits the line up
+    """
+    for width in widths:
+        if len(line) == 0:
+            yield ''
+        chunk, line = line[:width], line[width:]
+        value = _value_re.match(chunk)
+        yield value.group('value') if value is not None else ''
+
+
+def peak_pattern(header_line, unit_line, dash_line):
+    """
+    :param header_line: the line of column names of a peak table
+    :param unit_line: the line of column units under it
+    :param dash_line: the ----|----| line under the units, which gives the width of each column
+    :return: the compiled regex of a peak line of the table, built once for every layout
+    """
+    key = (header_line, unit_line, dash_line)
+    pattern = _peak_patterns.get(key)
+    if pattern is None:
+        widths = [len(dashes) + 1 for dashes in dash_line.split('|')]
+        parts = []
+        for header, unit in zip(_chunks(header_line, widths), _chunks(unit_line, widths)):
+            if header == '':
+                continue
+            if (header, unit) not in COLUMN_PATTERNS:
+                raise KeyError(f'the peak table column "{header}" "{unit}" is not known to the report parser')
+            parts.append(COLUMN_PATTERNS[(header, unit)])
+        pattern = _peak_patterns[key] = re.compile('^' + '[ ]+'.join(parts), re.MULTILINE)
+    return pattern
+
+
+def _convert(value):
+    try:
+        return float(value)
+    except ValueError:
+        return value
+
+
+def _find_separator(text, position):
+    """
+    :return: the (start, end) of the first ==== line at or after position, or None; the same as searching for the regex
+             '=+\\n', without the regex trying every '=' of a long line in turn
+    """
+    end = text.find('=\n', position)
+    if end == -1:
+        return None
+    start = end
+    while start > position and text[start - 1] == '=':
+        start -= 1
+    return start, end + 2
+
+
+def parse_report_text(text, signals=None, flex_signal=1., arrays=False):
+    """
+    :param text: the text of a Report.TXT file
+    :param signals: the wavelengths whose peak tables are wanted, None for every signal
+    :param flex_signal: how far (nm) a wavelength can be from one of the signals and still be kept, 1 nm by default
+                        so the wavelength HPLCTarget would pick is always there
+    :param arrays: False for a dictionary per peak, True for the SignalArrays of each wavelength
+    :return: the dictionary of {wavelength: {retention time: {Peak, RetTime, Type, Width, Area, Height, Name}}}, or
+             of {wavelength: SignalArrays} with arrays
+
+    :purpose: walks from one ==== line to the next instead of splitting the whole report up, and only runs the peak
+              regex over the tables of the wanted signals, one finditer per table rather than one match per line
+    """
+    if 'No peaks found' in text:
+        raise ValueError('No peaks found in Report.txt')
+    result = {}
+    block_start = 0
+    while True:
+        # the report is made of blocks between ==== lines, the peak tables are in the block after an area report title
+        separator = _find_separator(text, block_start)
+        if separator is None:
+            break
+        if _area_report_re.match(text, block_start):
+            end = _find_separator(text, separator[1])
+            _parse_signal_tables(text[separator[1]:end[0] if end is not None else len(text)], result, signals,
+                                 flex_signal, arrays)
+        block_start = separator[1]
+    if signals is not None:
+        # only the wanted wavelengths are returned, the others were skipped without parsing their tables
+        result = {wavelength: peaks for wavelength, peaks in result.items()
+                  if any(abs(wavelength - signal) <= flex_signal for signal in signals)}
+    return result
+
+
+def _parse_signal_tables(block, result, signals, flex_signal, arrays=False):
+    """
+    :param block: the block of an area report that holds a peak table for every signal
+    :param result: the dictionary the peaks are added to
+    :param signals: the wavelengths whose peak tables are wanted, None for every signal
+    :param flex_signal: how far (nm) a wavelength can be from one of the signals and still be kept
+    :param arrays: False for a dictionary per peak, True for the SignalArrays of each wavelength
+    """
+    for table in _signal_re.split(block):
+        info = _signal_info_re.match(table)
+        if info is None or info.group('error') != '':
+            continue
+        wavelength = float(info.group('wavelength'))
+        if wavelength in result:
+            raise KeyError(f'The wavelength {wavelength} is already in the signals dictionary')
+        result[wavelength] = _empty_arrays() if arrays else {}
+        if signals is not None and all(abs(wavelength - signal) > flex_signal for signal in signals):
+            continue
+        lines = table.split('\n', 5)
+        if len(lines) <= 4:     # a table without any columns
+            continue
+        pattern = peak_pattern(lines[2], lines[3], lines[4])
+        if arrays:
+            result[wavelength] = _table_arrays(pattern, table)
+            continue
+        numbers = [column for column in PEAK_COLUMNS if column in pattern.groupindex and column not in TEXT_COLUMNS]
+        texts = [column for column in TEXT_COLUMNS if column in pattern.groupindex]
+        peaks = result[wavelength]
+        for peak in pattern.finditer(table):
+            values = peak.groupdict()
+            row = dict.fromkeys(PEAK_COLUMNS)       # in the order of PEAK_COLUMNS, None for a missing column
+            try:
+                for column in numbers:
+                    row[column] = float(values[column])
+            except ValueError:      # eg. a number with a comma, which is kept as text
+                for column in numbers:
+                    row[column] = _convert(values[column])
+            for column in texts:
+                row[column] = _convert(values[column])
+            peaks[float(values['RetTime'])] = row
+
+
+def _empty_arrays():
+    return SignalArrays(*(np.empty(0) for column in NUMBER_COLUMNS))
+
+
+def _to_float(values):
+    try:
+        return np.array(values, dtype=np.float64)
+    except ValueError:      # eg. a number with a comma, which the dictionary keeps as text and has no float value
+        return np.array([value if isinstance(value, float) else np.nan for value in map(_convert, values)])
+
+
+def _table_arrays(pattern, table):
+    """
+    :param pattern: the compiled peak regex of the table
+    :param table: the text of the peak table of one signal
+    :return: the SignalArrays of the table, from one findall over the whole table and one conversion of all its
+             numbers; a retention time that is in the table twice keeps its last peak, as it does in the dictionary
+    """
+    groups = [name for name, index in sorted(pattern.groupindex.items(), key=lambda item: item[1])]
+    present = [column for column in NUMBER_COLUMNS if column in groups]
+    matches = pattern.findall(table)
+    if len(matches) == 0:
+        return _empty_arrays()
+    if len(groups) == 1:
+        matches = [(match,) for match in matches]
+    indices = [groups.index(column) for column in present]
+    text = np.array(matches)[:, indices]
+    try:
+        numbers = text.astype(np.float64).T
+    except ValueError:
+        numbers = np.array([_to_float(column) for column in text.T])
+    retention_time = numbers[present.index('RetTime')]
+    if len(retention_time) > 1 and not (retention_time[1:] > retention_time[:-1]).all():
+        # out of order or repeated: the last peak of each retention time, in retention time order
+        _, last = np.unique(retention_time[::-1], return_index=True)
+        numbers = numbers[:, len(retention_time) - 1 - last]
+    numbers = np.ascontiguousarray(numbers)
+    return SignalArrays(*(numbers[present.index(column)] if column in present else np.full(numbers.shape[1], np.nan)
+                          for column in NUMBER_COLUMNS))
+
+
+def parse_report(complete_name, signals=None):
+    """
+    :param complete_name: the path to the Report.TXT file
+    :param signals: the wavelengths whose peak tables are wanted, None for every signal
+    :return: the dictionary of {wavelength: {retention time: {Peak, RetTime, Type, Width, Area, Height, Name}}}, the
+             same as aghplctools.ingestion.text.pull_hplc_area_from_txt
+    """
+    return parse_report_text(read_report_text(complete_name), signals)
+
+
+def parse_report_arrays(complete_name, signals=None):
+    """
+    :param complete_name: the path to the Report.TXT file
+    :param signals: the wavelengths whose peak tables are wanted, None for every signal
+    :return: the dictionary of {wavelength: SignalArrays}, holding the same numbers as parse_report without a
+             dictionary per peak
+    """
+    return parse_report_text(read_report_text(complete_name), signals, arrays=True)
+
+
+def arrays_from_dictionary(dictionary):
+    """
+    :param dictionary: the dictionary of {wavelength: {retention time: peak}} of parse_report or aghplctools
+    :return: the dictionary of {wavelength: SignalArrays} parse_report_arrays gives for the same report
+    """
+    result = {}
+    for wavelength, peaks in dictionary.items():
+        rows = [peaks[ret_time] for ret_time in sorted(peaks)]
+        result[wavelength] = SignalArrays(*(np.array(
+            [row[column] if isinstance(row[column], float) else np.nan for row in rows], dtype=np.float64)
+            for column in NUMBER_COLUMNS))
+    return result
+
+
+def _same_arrays(expected, actual):
+    return list(expected) == list(actual) and all(
+        np.array_equal(expected_column, actual_column, equal_nan=True)
+        for wavelength in expected for expected_column, actual_column in zip(expected[wavelength], actual[wavelength]))
+
+
+def compare_parsers(directories):
+    """
+    :param directories: the paths to the Report.TXT files to check
+    :return: a list of (directory, description) of every report the two parsers disagree on
+
+    :purpose: the differential check of parse_report and parse_report_arrays against aghplctools, run on real reports
+              before relying on them
+    """
+    from aghplctools.ingestion.text import pull_hplc_area_from_txt       # the reference parser
+    mismatches = []
+    for directory in directories:
+        outcomes = []
+        for parser in (pull_hplc_area_from_txt, parse_report, parse_report_arrays):
+            try:
+                outcomes.append(('result', parser(directory)))
+            except (ValueError, KeyError) as error:
+                outcomes.append(('error', type(error).__name__))
+        expected, actual, actual_arrays = outcomes
+        if expected != actual:
+            if expected[0] != actual[0]:
+                description = f'aghplctools gave {expected[0]} {expected[1] if expected[0] == "error" else ""}, ' \
+                              f'parse_report gave {actual[0]} {actual[1] if actual[0] == "error" else ""}'
+            else:
+                description = _describe_difference(expected[1], actual[1])
+            mismatches.append((directory, description))
+        elif expected[0] != actual_arrays[0] or (expected[0] == 'result' and not _same_arrays(
+                arrays_from_dictionary(expected[1]), actual_arrays[1])):
+            mismatches.append((directory, 'parse_report_arrays differs from the aghplctools dictionary'))
+    return mismatches
+
+
+def _describe_difference(expected, actual):
+    if list(expected) != list(actual):
+        return f'signals {list(expected)} != {list(actual)}'
+    for wavelength in expected:
+        if list(expected[wavelength]) != list(actual[wavelength]):
+            return f'retention times of {wavelength} differ'
+        for ret_time, peak in expected[wavelength].items():
+            if peak != actual[wavelength][ret_time]:
+                return f'peak {ret_time} of {wavelength}: {peak} != {actual[wavelength][ret_time]}'
+    return 'the dictionaries differ'
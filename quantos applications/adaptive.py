@@ -0,0 +1,150 @@
+"""
+plans the trials of a Quantos sweep adaptively: a target mass stops getting trials once its percent error is known
+precisely enough, and extra masses are added where the error changes sharply
+
+Author(s):      Ioana David
+Last modified:  Oct. 18th, 2026
+
+"""
+import collections
+
+
+class AdaptivePlanner:
+    """
+    PURPOSE     decides when a target mass has had enough trials, and where to refine the mass grid
+    """
+
+    def __init__(self, precision, min_trials=3, max_trials=30, level=0.95, refine_threshold=None, min_increment=1,
+                 max_refinements=3):
+        """
+        PARAMETERS  precision:          the half-width of the confidence interval on the mean percent error to reach,
+                                        as a fraction (0.005 is +/- 0.5%)
+                    min_trials:         the number of trials every mass gets, however precise it already is
+                    max_trials:         the number of trials after which a mass stops, however imprecise it still is
+                    level:              the confidence level of the interval
+                    refine_threshold:   the change in mean percent error (as a fraction) between two neighbouring
+                                        masses above which the mass between them is added, None to keep the grid
+                    min_increment:      the smallest spacing (mg) the grid is refined down to
+                    max_refinements:    the number of times the grid can be refined
+        """
+        if min_trials < 2:
+            raise ValueError("min_trials has to be at least 2 for a confidence interval")
+        if max_trials < min_trials:
+            raise ValueError("max_trials cannot be less than min_trials")
+        self.precision = precision
+        self.min_trials = min_trials
+        self.max_trials = max_trials
+        self.level = level
+        self.refine_threshold = refine_threshold
+        self.min_increment = min_increment
+        self.max_refinements = max_refinements
+
+    def needs_more(self, stats, target_mass):
+        """
+        PARAMETERS  stats:          the SweepStatistics of the sweep
+                    target_mass:    the mass (mg) to check
+        RETURN      True if the mass needs another trial
+        """
+        trials = stats.trials(target_mass)
+        if trials < self.min_trials:
+            return True
+        if trials >= self.max_trials:
+            return False
+        return not stats.percent_error[target_mass].confidence_interval(self.level) <= self.precision
+
+    def plan(self, stats, masses, in_progress, instruments, queued):
+        """
+        PARAMETERS  stats:          the SweepStatistics of the sweep
+                    masses:         the target masses (mg) of the grid
+                    in_progress:    the (target mass, trial) pairs being dispensed
+                    instruments:    the number of instruments in the sweep
+                    queued:         a Counter of the trials queued so far for each mass, which plan advances; a mass it
+                                    has not seen starts from stats.trials, so a resumed sweep carries on from its log
+        RETURN      the (target mass, trial) pairs to dispense next: every trial a mass still needs to reach min_trials,
+                    up front; one more trial for a mass that is past min_trials, still needs more and has none in
+                    progress; and, while that leaves instruments idle, extra trials of the masses that still need more
+                    (up to max_trials), so near the end of a sweep no instrument waits for another
+
+                    the trials are counted and numbered from queued rather than from stats plus in_progress: a
+                    dispense whose result is already in stats can still be in progress, and would be counted twice
+        """
+        pending = collections.Counter(mass for mass, trial in in_progress)
+        planned = collections.Counter()
+        wanting = []        # the masses that can still take a trial beyond what is planned
+        for mass in masses:
+            if mass not in queued:
+                queued[mass] = stats.trials(mass)
+            trials = queued[mass]
+            if trials < self.min_trials:
+                planned[mass] = self.min_trials - trials
+            elif pending[mass] == 0 and self.needs_more(stats, mass):
+                planned[mass] = 1
+            if self.needs_more(stats, mass) and trials + planned[mass] < self.max_trials:
+                wanting.append(mass)
+        idle = instruments - len(in_progress) - sum(planned.values())
+        while idle > 0 and wanting:
+            for mass in list(wanting):
+                if idle == 0:
+                    break
+                planned[mass] += 1
+                idle -= 1
+                if queued[mass] + planned[mass] >= self.max_trials:
+                    wanting.remove(mass)
+        work = []
+        for mass in masses:
+            work.extend((mass, trial) for trial in range(queued[mass], queued[mass] + planned[mass]))
+            queued[mass] += planned[mass]
+        return work
+
+    def refine(self, stats, masses):
+        """
+        PARAMETERS  stats:  the SweepStatistics of the sweep
+                    masses: the target masses (mg) of the grid so far
+        RETURN      the new masses to add, halfway between neighbouring masses whose mean percent error differs by more
+                    than refine_threshold
+        """
+        if self.refine_threshold is None:
+            return []
+        masses = sorted(masses)
+        new_masses = []
+        for lower, upper in zip(masses, masses[1:]):
+            change = abs(stats.percent_error[upper].mean - stats.percent_error[lower].mean)
+            middle = round((lower + upper) / 2 / self.min_increment) * self.min_increment
+            if change > self.refine_threshold and lower < middle < upper:
+                new_masses.append(middle)
+        return new_masses
+
+
+def run_adaptive_sweep(planner, masses, scheduler, stats, on_result):
+    """
+    PURPOSE     dispenses the trials the planner asks for in one run of the scheduler, planning more whenever its queue
+                runs dry so every instrument stays busy, and refines the grid once every mass has stopped
+    PARAMETERS  planner:    an AdaptivePlanner
+                masses:     the target masses (mg) to start with
+                scheduler:  the DosingScheduler to dispense with
+                stats:      the SweepStatistics of the sweep, which on_result has to update
+                on_result:  called as on_result(instrument name, target mass, trial, quantity, timings) after each
+                            dispense
+    RETURN      the masses of the final grid, and the (target mass, trial) pairs no instrument could dispense
+    """
+    masses = sorted(set(masses))
+    refinements = 0
+    queued = collections.Counter()      # the trials handed out for each mass, so every trial number is used once
+
+    def refill(in_progress, instruments):
+        nonlocal masses, refinements
+        while True:
+            work = planner.plan(stats, masses, in_progress, instruments, queued)
+            if work or in_progress or refinements >= planner.max_refinements:
+                return work
+            # every mass has stopped and every result is in, so the grid can be refined
+            refinements += 1
+            new_masses = planner.refine(stats, masses)
+            if len(new_masses) == 0:
+                refinements = planner.max_refinements
+                return []
+            print("refining the mass grid with:", new_masses)
+            masses = sorted(masses + new_masses)
+
+    unfinished = scheduler.run([], on_result, refill=refill)
+    return masses, unfinished
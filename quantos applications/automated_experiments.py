@@ -5,109 +5,198 @@ Author(s):      Ioana David
 Last modified:  Mar. 13th, 2020
 
 """
-from quantos.api import Quantos
-import json
+import argparse
 import os
-import csv
-from quantos.data import SampleData
-from unithandler.base import UnitFloat
+import time
+from export import export_results
+from instrumentation import DispenseTimer, timed
+from result_log import ResultLog, completed_trials, read_result_log, summarize_results
+from adaptive import AdaptivePlanner, run_adaptive_sweep
+from orchestration import DosingScheduler
+from running_stats import SweepStatistics, format_summary
+from simulated_quantos import SimulatedQuantos
 
-quan = Quantos(address='10.0.0.1', logging_level=10)
+# the Quantos units on the bench; the dispenses of a sweep are shared between all of them
+QUANTOS_ADDRESSES = ['10.0.0.1']
+
+# 'hardware' connects to the Quantos units, 'simulated' dispenses with SimulatedQuantos instead (for dry runs)
+QUANTOS_BACKEND = os.environ.get('QUANTOS_BACKEND', 'hardware')
+# the part of the simulated dosing time that is actually slept, 0 to run as fast as possible
+QUANTOS_TIME_SCALE = float(os.environ.get('QUANTOS_TIME_SCALE', '0'))
 
 # setting json file path to save to
 cur_dir = os.path.abspath(os.path.curdir)
-DATA_FILE_PATH = os.path.join(cur_dir, 'quantos_data.json')
+DATA_FILE_PATH = os.path.join(cur_dir, 'quantos_data.jsonl')
+
+_instruments = None
+
+
+def create_instruments(addresses=QUANTOS_ADDRESSES, backend=QUANTOS_BACKEND, time_scale=QUANTOS_TIME_SCALE, seed=None,
+                       **model):
+    """
+    PURPOSE     connects to the instruments of a sweep, or creates simulated ones
+    PARAMETERS  addresses:  the addresses of the Quantos units
+                backend:    'hardware' or 'simulated'
+                time_scale: the part of the simulated dosing time that is slept (simulated backend only)
+                seed:       the seed of the simulated noise, each instrument gets its own stream (simulated backend only)
+                model:      the error model of SimulatedQuantos, eg. bias=0.01, relative_noise=0.005
+    RETURN      a dictionary of {address: instrument}
+    """
+    if backend == 'simulated':
+        return {address: SimulatedQuantos(address=address, time_scale=time_scale,
+                                          seed=None if seed is None else seed + index, **model)
+                for index, address in enumerate(addresses)}
+    if backend != 'hardware':
+        raise ValueError(f"unknown Quantos backend {backend!r}, use 'hardware' or 'simulated'")
+    from quantos.api import Quantos      # only needed on the bench
+    return {address: Quantos(address=address, logging_level=10) for address in addresses}
 
 
-def change_mass_and_dispense(target_mass):
+def get_instruments():
+    """
+    RETURN      the instruments of the configured backend, created the first time they are needed
+    """
+    global _instruments
+    if _instruments is None:
+        _instruments = create_instruments()
+    return _instruments
+
+
+def change_mass_and_dispense(target_mass, instrument=None, timings=None):
     """
     PURPOSE     update the target mass (mg), dispense powder
     PARAMETERS  target mass: sets the desired target mass (mg) for the quantos to dispense
+                instrument: the Quantos to dispense with, the first configured instrument by default
+                timings: a dictionary that the time (s) of each phase of the dispense is stored in, or None
     RETURN      the sample data (quantity dispensed, in mg)
     """
-    quan.target_mass = target_mass
-    quan.start_dosing(wait_for=True)
-    x = quan.sample_data.quantity        # making sure that we have the correct numbers coming out, nothing's jumbled
+    if instrument is None:
+        instrument = next(iter(get_instruments().values()))
+    with timed(timings, 'total'):
+        with timed(timings, 'set_target'):
+            instrument.target_mass = target_mass
+        with timed(timings, 'dosing'):
+            instrument.start_dosing(wait_for=True)
+        with timed(timings, 'read'):
+            x = instrument.sample_data.quantity        # making sure that we have the correct numbers coming out, nothing's jumbled
     return float(x)      # type conversion to make sure we can use the information
 
 
-def run_script(json_file_name):
+def run_script(json_file_name, instruments=None):
     """
     PURPOSE     runs experiments with the user inputting their desired lower & upper mass, increment, and number of trials
-    PARAMETER   the name of the JSON file in which you store the data
+                every dispense is appended to the log as soon as it is done, so nothing is lost if the script stops
+                the dispenses are shared between the instruments, which dispense at the same time
+    PARAMETERS  json_file_name: the name of the JSON Lines file in which you log the data
+                instruments:    a dictionary of {address: Quantos} to dispense with, the configured ones by default
     RETURN      a list of all of the desired masses passed to the function, as well as the number of trials for each
 
     """
-    stored_data = {}        # empty dictionary to store everything
-    list_data = []
-    percent_data = []
-    sum_error = 0           # initialize the variable
+    if instruments is None:
+        instruments = get_instruments()
     cond_values = []
+    stats = SweepStatistics()       # running mean / CI / CV of every target mass, updated after each dispense
+
+    # picks up where an interrupted sweep stopped, skipping the trials that are already in the log
+    last_sweep, done = completed_trials(json_file_name)
+    sweep = last_sweep + 1
+    if last_sweep >= 0:
+        response = input("This log already has dispenses in it. Resume the last sweep, skipping its finished trials? yes/no (case sensitive): ")
+        if response == 'yes':
+            sweep = last_sweep
+            for record in read_result_log(json_file_name):
+                if record['sweep'] == last_sweep:
+                    stats.update(record['target_mass'], record['quantity'])
+        else:
+            done = set()
 
     run_experiment = True
+    timer = DispenseTimer()         # latency histograms of every phase, per instrument and per target mass
+    scheduler = DosingScheduler(instruments, change_mass_and_dispense, timer=timer)
+
+    with ResultLog(json_file_name) as log:
+        while run_experiment:
+            lower_mass = int(input("Lower mass (mg): "))
+            while lower_mass <= 0:
+                lower_mass = int(input("Error: lower mass cannot be less than, or equal to 0. Please enter a new value (mg): "))
+            upper_mass = int(input("Upper mass (mg): "))
+            while upper_mass < lower_mass:
+                upper_mass = int(input("Upper mass cannot be lower than lower mass. Please enter a new value (mg): "))
+            if upper_mass > lower_mass:
+                increment = int(input("Mass (mg) by which to increment: "))
+            if upper_mass == lower_mass:
+                increment = 1
+            while lower_mass + increment > upper_mass & upper_mass != lower_mass:
+                increment = int(input("Increment is invalid, please enter a new value (mg): "))
+            adaptive = input("Stop each mass once its percent error is precise enough (adaptive)? yes/no (case sensitive): ") == 'yes'
+            if adaptive:
+                precision = float(input("Precision to reach, +/- percent error at 95% confidence (eg. 0.5): ")) / 100
+                min_trials = int(input("Minimum number of trials: "))
+                iterations = int(input("Maximum number of trials: "))
+                refine = input("Percent error change between masses above which the grid is refined (blank to keep the grid): ")
+                planner = AdaptivePlanner(precision, min_trials=min_trials, max_trials=iterations,
+                                          refine_threshold=float(refine) / 100 if refine else None)
+            else:
+                iterations = int(input("Number of trials: "))
+            mass = lower_mass
+            count = 0
+            while mass <= upper_mass:
+                count += 1
+                mass += increment
+            cond_values.append(count)       # this is the number of conditions
+            mass = lower_mass
+            while mass <= upper_mass:
+                cond_values.append(mass)
+                # print("mass:", mass)
+                mass += increment
+            cond_values.append(iterations)
+
+            def on_result(name, desired_mass, i, sample_data, timings):
+                # one record per dispense, with the time of each of its phases
+                log.write(sweep, i, desired_mass, sample_data, instrument=name,
+                          **{f'{phase}_s': seconds for phase, seconds in timings.items()})
+                print(f"{name} trial {i + 1}: {sample_data:.3f} mg ->", format_summary(stats.update(desired_mass, sample_data)))
 
-    while run_experiment:
-        lower_mass = int(input("Lower mass (mg): "))
-        while lower_mass <= 0:
-            lower_mass = int(input("Error: lower mass cannot be less than, or equal to 0. Please enter a new value (mg): "))
-        upper_mass = int(input("Upper mass (mg): "))
-        while upper_mass < lower_mass:
-            upper_mass = int(input("Upper mass cannot be lower than lower mass. Please enter a new value (mg): "))
-        if upper_mass > lower_mass:
-            increment = int(input("Mass (mg) by which to increment: "))
-        if upper_mass == lower_mass:
-            increment = 1
-        while lower_mass + increment > upper_mass & upper_mass != lower_mass:
-            increment = int(input("Increment is invalid, please enter a new value (mg): "))
-        iterations = int(input("Number of trials: "))
-        mass = lower_mass
-        count = 0
-        while mass <= upper_mass:
-            count += 1
-            mass += increment
-        cond_values.append(count)       # this is the number of conditions
-        mass = lower_mass
-        while mass <= upper_mass:
-            cond_values.append(mass)
-            # print("mass:", mass)
-            mass += increment
-        cond_values.append(iterations)
-
-        for desired_mass in range(lower_mass, upper_mass + 1, increment):
-            for i in range(0, iterations):
-                sample_data = change_mass_and_dispense(desired_mass)
-                list_data.insert(i, sample_data)
-                percent_error = abs((sample_data - desired_mass) / desired_mass)
-                percent_data.insert(i, percent_error)
-            for j in range(0, iterations):      # calculate the average percent error
-                sum_error += percent_data[j]
-                if j == (iterations - 1):
-                    avg_error = sum_error / iterations
-                    list_data.insert(iterations, avg_error)  # add the avg % error to the end of the list
-                    stored_data.update({desired_mass: list_data[0:(iterations + 1)]})  # append the dictionary
-        with open(json_file_name, 'w') as file:
-            json.dump(stored_data, file)
-        run_experiment = input("run experiment again? TRUE (yes) or FALSE (no): ")
-        if run_experiment == 'FALSE':
-            break
-        if run_experiment == 'no':
-            break
-        if run_experiment == 'yes':
-            run_experiment = True
-        if run_experiment == 'TRUE':
-            run_experiment = True
-        with open(json_file_name, 'a') as file:
-            json.dump(stored_data, file)
+            if adaptive:
+                masses, unfinished = run_adaptive_sweep(planner, range(lower_mass, upper_mass + 1, increment),
+                                                        scheduler, stats, on_result)
+                print("final mass grid:", masses)
+            else:
+                work = [(desired_mass, i) for desired_mass in range(lower_mass, upper_mass + 1, increment)
+                        for i in range(0, iterations) if (desired_mass, i) not in done]
+                unfinished = scheduler.run(work, on_result)
+            if unfinished:
+                print("resume this sweep once the instruments are fixed to dispense:", unfinished)
+            print("\nsweep summary:")
+            for summary in stats.summaries():
+                print(format_summary(summary))
+            sweep += 1
+            done = set()
+            stats = SweepStatistics()
+            log.sync()
+            run_experiment = input("run experiment again? TRUE (yes) or FALSE (no): ")
+            if run_experiment == 'FALSE':
+                break
+            if run_experiment == 'no':
+                break
+            if run_experiment == 'yes':
+                run_experiment = True
+            if run_experiment == 'TRUE':
+                run_experiment = True
     print("\nexiting experiment ... ")
-    print("Stored data:", stored_data)  # debugging
+    print("Stored data:", summarize_results(json_file_name))  # debugging
+    timings_file_name = os.path.splitext(json_file_name)[0] + '_timings'
+    timer.export(timings_file_name + '.csv')
+    timer.export(timings_file_name + '.json')
+    timer.print_summary()
     return cond_values
 
 
 def create_json_file_path():
     """
-    PURPOSE    gets the file path of the json file
+    PURPOSE    gets the file path of the json lines file that the dispenses are logged to
     PARAMETER   none
-    RETURN     the name of the json file (str)
+    RETURN     the name of the json lines file (str)
 
     credit: veronica lai
     source: https://gitlab.com/heingroup/ika/-/blob/master/ika/tests/json_utilities.py
@@ -115,11 +204,11 @@ def create_json_file_path():
     count = True
     get_json_file_name = True
     print("If you do not already have a JSON file created, enter your desired names in the prompt below and they will be automatically made and stored in the same folder as this script.")
-    print("If you have a JSON file already made and would like to use those (overwriting their contents), enter their names below when prompted.")
+    print("If you have a JSON file already made and would like to use it, enter its name below when prompted. Its contents are kept: new dispenses are appended to it, and you will be asked whether to resume its last sweep.")
     while get_json_file_name:
         json_file_name = input("What is the name of your JSON file? ")
-        if json_file_name[-4:] != '.json':
-            json_file_name += '.json'
+        if json_file_name[-6:] != '.jsonl':
+            json_file_name += '.jsonl'
         print("Your JSON file is:", json_file_name)
         response = input("Confirm JSON file name with a yes/no (case sensitive): ")
         if response == 'yes':
@@ -152,92 +241,78 @@ def create_csv_file_path():
     return csv_file_name
 
 
-def convert_dict_to_flat_list(json_file_name):
-    """
-    PURPOSE     converts the dictionaries produced in the script and stored in the JSON file to a flattened list
-    PARAMETER   the json file, which contains one or more dictionaries with experimental data
-    RETURN      a flattened str list made from the dictionaries in the json file
-    """
-    temp = []
-    temp2 = []
-    dict_list = []
-    flat_list = []
-    with open(json_file_name, 'r') as file:
-        dictionary = json.load(file)
-    # converts dictionary to list
-    for key, value in dictionary.items():
-        temp = [key, value]
-        dict_list.extend(temp)          # extend vs append
-    # takes care of the nested lists as those are not flattened
-    for i in range(0, len(dict_list)):
-        if type(dict_list[i]) == list:
-            temp2 = str(dict_list[i])
-            dict_list[i] = temp2[1:-1]  # get rid of the square brackets
-        if type(dict_list[i]) == int:
-            dict_list[i] = str(dict_list[i])
-    return dict_list
-
-
-def convert_flat_dict_to_list(list_str):
+def load_test(json_file_name, csv_file_name, masses, trials, instruments=None):
     """
-    PURPOSE     will parse through a list with str values and convert them to int
-                will look for comma separated values and assign them their own index
-    PARAMETERS  list_str: a flattened list of string values
-    RETURN      a float list that can be then sent to a CSV file easily :-)
+    PURPOSE     runs a sweep without any prompts and reports how fast the dispenses were logged, summarized and
+                exported; meant for the simulated backend, to load test everything but the instrument
+    PARAMETERS  json_file_name: the JSON Lines file to log to
+                csv_file_name:  the csv or parquet file to export to
+                masses:         the target masses (mg)
+                trials:         the number of trials of each mass
+                instruments:    a dictionary of {address: instrument}, the configured ones by default
+    RETURN      the summaries of the sweep, one per target mass
     """
-    final_list = []     # empty list
-    for i in range(0, len(list_str)):
-        temp_str = list_str[i]
-        if i % 2 == 0:          # even index
-            final_list.append(float(temp_str))
-        else:                   # odd index
-            temp_split = temp_str.split(', ')
-            for j in range(0, len(temp_split)):
-                temp_int = float(temp_split[j])
-                final_list.append(temp_int)
-    print("final_list:", final_list)
-    return final_list
-
-
-def list_to_csv(flat_list, cond_values, csv_file_name):
-    """
-    PURPOSE     takes the list of values from the JSON file, and the different condition values from the experiment script to send data to a CSV file
-    PARAMETERS  flat_list:      a list of data parsed from a JSON file
-                cond_values:    a list formatted in [number_of_conditions, cond_1, cond_2, ... , cond_n, number_of_trials]
-                csv_file_name:  the name of the csv file we wish to send the data
-    RETURN       none
-    """
-    mass_list = []
-
-    with open(csv_file_name, 'w', newline="") as csv_file:
-        writer = csv.writer(csv_file)
-        mass_list.clear()
-        num_conditions = cond_values[0]
-        mass_list.extend(cond_values[1:num_conditions + 1])  # write the different condition values & the number of trials at the end
-        num_trials = cond_values[-1]
-        for j in range(0, len(flat_list)+2, 1):
-            if j >= len(flat_list):
-                j = 0
-            if len(flat_list) == 0:
-                break
-            if mass_list[0] == flat_list[j]:      # if the number matches a desired_mass that we have sent it
-                writer.writerow(flat_list[0:num_trials+2])   # this will cause a new row every time it is written
-                del mass_list[0]
-                # L = 0
-                for L in range(0, num_trials+2):
-                    del flat_list[0]            # pop the number of trials that we have successfully written
+    if instruments is None:
+        instruments = get_instruments()
+    stats = SweepStatistics()
+    timer = DispenseTimer()
+    scheduler = DosingScheduler(instruments, change_mass_and_dispense, retry_delay=0, timer=timer)
+    sweep = completed_trials(json_file_name)[0] + 1
+
+    start = time.perf_counter()
+    with ResultLog(json_file_name) as log:
+        def on_result(name, desired_mass, i, sample_data, timings):
+            log.write(sweep, i, desired_mass, sample_data, instrument=name,
+                      **{f'{phase}_s': seconds for phase, seconds in timings.items()})
+            stats.update(desired_mass, sample_data)
+
+        unfinished = scheduler.run([(mass, i) for mass in masses for i in range(trials)], on_result)
+    dispensed = len(masses) * trials - len(unfinished)
+    sweep_time = time.perf_counter() - start
+    start = time.perf_counter()
+    rows = export_results(json_file_name, csv_file_name)
+    export_time = time.perf_counter() - start
+
+    for summary in stats.summaries():
+        print(format_summary(summary))
+    timer.print_summary()
+    print(f"{dispensed} dispenses on {len(instruments)} instruments in {sweep_time:.2f} s "
+          f"({dispensed / sweep_time:.0f} dispenses/s), exported {rows} rows in {export_time:.2f} s")
+    return stats.summaries()
+
+
+def main():
+    global _instruments
+    parser = argparse.ArgumentParser(description="collects data from the Quantos to test reproducibility")
+    parser.add_argument('--backend', choices=['hardware', 'simulated'], default=QUANTOS_BACKEND,
+                        help="dispense with the Quantos units or with simulated ones (default: $QUANTOS_BACKEND)")
+    parser.add_argument('--time-scale', type=float, default=QUANTOS_TIME_SCALE,
+                        help="the part of the simulated dosing time to sleep, 1 for real time, 0 for none")
+    parser.add_argument('--seed', type=int, default=None, help="the seed of the simulated noise")
+    parser.add_argument('--load-test', nargs=3, type=int, metavar=('LOWER', 'UPPER', 'INCREMENT'),
+                        help="run a sweep from LOWER to UPPER mg without prompts and time the logging and export")
+    parser.add_argument('--trials', type=int, default=1000, help="the number of trials of each mass of --load-test")
+    arguments = parser.parse_args()
+    _instruments = create_instruments(backend=arguments.backend, time_scale=arguments.time_scale, seed=arguments.seed)
+
+    if arguments.load_test:
+        lower_mass, upper_mass, increment = arguments.load_test
+        load_test(os.path.join(cur_dir, 'load_test.jsonl'), os.path.join(cur_dir, 'load_test.csv'),
+                  list(range(lower_mass, upper_mass + 1, increment)), arguments.trials)
+        return
+
+    json_name = create_json_file_path()
+    csv_name = create_csv_file_path()
+    values = run_script(json_name)
+    rows = export_results(json_name, csv_name)      # one row per dispense, straight from the log
+    print(f"exported {rows} dispenses to {csv_name}")
+    print("all done!")
 
 
-json_name = create_json_file_path()
-csv_name = create_csv_file_path()
-values = run_script(json_name)
-flat_str_list = convert_dict_to_flat_list(json_name)
-csv_dictionary = convert_flat_dict_to_list(flat_str_list)
-list_to_csv(csv_dictionary, values, csv_name)
-print("all done!")
+if __name__ == '__main__':
+    main()
 
 
 # TODO - maybe add a thing where we can give a name to the powder we're using?
 # like we have a string etc. so that when the data is saved to the JSON file it's easy to identify
 # TODO - clarify that the values we gave it are the ones we want to use (in case we accidentally send it the wrong #)
-# TODO - add titles to the headers that we're printing (eg. mass, trial #)?
\ No newline at end of file
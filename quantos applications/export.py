@@ -0,0 +1,69 @@
+"""
+exports the dispenses logged by ResultLog to a CSV file, a parquet file or a DataFrame in a single pass
+
+Author(s):      Ioana David
+Last modified:  Oct. 18th, 2026
+
+"""
+import csv
+import os
+from result_log import read_result_log
+
+EXPORT_HEADER = ['sweep', 'target mass (mg)', 'trial #', 'quantity (mg)', 'percent error']
+
+
+def trial_rows(records):
+    """
+    PURPOSE     turns each logged dispense into one row of the export
+    PARAMETER   records: an iterable of the records from read_result_log
+    RETURN      a generator of [sweep, target mass, trial #, quantity, percent error] lists, trials counted from 1
+    """
+    for record in records:
+        yield [record['sweep'], record['target_mass'], record['trial'] + 1, record['quantity'], record['percent_error']]
+
+
+def export_to_csv(records, csv_file_name):
+    """
+    PURPOSE     streams the records straight into a CSV file with a header row, one row per dispense
+    PARAMETERS  records:        an iterable of the records from read_result_log
+                csv_file_name:  the name of the csv file we wish to send the data, its contents are replaced
+    RETURN      the number of rows written
+    """
+    count = 0
+    with open(csv_file_name, 'w', newline="") as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(EXPORT_HEADER)
+        for row in trial_rows(records):
+            writer.writerow(row)
+            count += 1
+    return count
+
+
+def export_to_dataframe(records):
+    """
+    PURPOSE     collects the records into a pandas DataFrame, filling the columns in one pass
+    PARAMETER   records: an iterable of the records from read_result_log
+    RETURN      a DataFrame with the EXPORT_HEADER columns
+    """
+    import pandas as pd         # only needed for the DataFrame and parquet exports
+    columns = [[] for _ in EXPORT_HEADER]
+    for row in trial_rows(records):
+        for column, value in zip(columns, row):
+            column.append(value)
+    return pd.DataFrame(dict(zip(EXPORT_HEADER, columns)))
+
+
+def export_results(json_file_name, output_file_name):
+    """
+    PURPOSE     exports every dispense in a log, picking the format from the extension of the output file
+    PARAMETERS  json_file_name:     the json lines file written by ResultLog
+                output_file_name:   a .csv or .parquet file
+    RETURN      the number of rows written
+    """
+    records = read_result_log(json_file_name)
+    extension = os.path.splitext(output_file_name)[1].lower()
+    if extension == '.parquet':
+        data = export_to_dataframe(records)
+        data.to_parquet(output_file_name, index=False)
+        return len(data)
+    return export_to_csv(records, output_file_name)
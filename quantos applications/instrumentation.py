@@ -0,0 +1,156 @@
+"""
+times each phase of every Quantos dispense and keeps latency histograms per instrument and per target mass
+
+Author(s):      Ioana David
+Last modified:  Oct. 18th, 2026
+
+"""
+import csv
+import json
+import math
+import os
+import time
+from contextlib import contextmanager
+
+PHASES = ['set_target', 'dosing', 'read', 'total']
+
+
+@contextmanager
+def timed(timings, phase):
+    """
+    PURPOSE     times the block inside the with statement on the monotonic clock
+    PARAMETERS  timings:    the dictionary the time (s) is stored in, or None to not time anything
+                phase:      the name of the phase, the key of the time in timings
+    """
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[phase] = time.perf_counter() - start
+
+
+class LatencyHistogram:
+    """
+    PURPOSE     a histogram of latencies with logarithmic buckets (from 1 ms to about 3 hours), so it takes the same
+                memory however many dispenses are added
+    """
+
+    def __init__(self, smallest=1e-3, buckets_per_decade=10, decades=7):
+        self.smallest = smallest
+        self.buckets_per_decade = buckets_per_decade
+        self.counts = [0] * (buckets_per_decade * decades + 1)
+        self.count = 0
+        self.total = 0.0
+        self.minimum = math.inf
+        self.maximum = -math.inf
+
+    def _bucket(self, seconds):
+        if seconds <= self.smallest:
+            return 0
+        bucket = int(math.log10(seconds / self.smallest) * self.buckets_per_decade) + 1
+        return min(bucket, len(self.counts) - 1)
+
+    def upper_edge(self, bucket):
+        """
+        RETURN      the largest latency (s) that falls in a bucket
+        """
+        return self.smallest * 10 ** (bucket / self.buckets_per_decade)
+
+    def add(self, seconds):
+        self.counts[self._bucket(seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.minimum = min(self.minimum, seconds)
+        self.maximum = max(self.maximum, seconds)
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else math.nan
+
+    def quantile(self, quantile):
+        """
+        RETURN      the upper edge of the bucket that holds the quantile, at most 26% above the true value
+        """
+        if self.count == 0:
+            return math.nan
+        rank = quantile * self.count
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return min(self.upper_edge(bucket), self.maximum)
+        return self.maximum
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'mean_s': self.mean,
+            'min_s': self.minimum if self.count else math.nan,
+            'p50_s': self.quantile(0.5),
+            'p90_s': self.quantile(0.9),
+            'p99_s': self.quantile(0.99),
+            'max_s': self.maximum if self.count else math.nan,
+        }
+
+
+class DispenseTimer:
+    """
+    PURPOSE     collects the phase timings of every dispense into latency histograms per instrument and per target mass
+    """
+
+    def __init__(self):
+        self.histograms = {}        # (group, key, phase) -> LatencyHistogram
+
+    def record(self, instrument, target_mass, timings):
+        """
+        PARAMETERS  instrument:     the name of the instrument that dispensed
+                    target_mass:    the mass (mg) it was asked to dispense
+                    timings:        a dictionary of {phase: seconds} from change_mass_and_dispense
+        """
+        for phase, seconds in timings.items():
+            for group, key in (('instrument', instrument), ('target mass', target_mass)):
+                histogram = self.histograms.get((group, key, phase))
+                if histogram is None:
+                    histogram = self.histograms[(group, key, phase)] = LatencyHistogram()
+                histogram.add(seconds)
+
+    def rows(self):
+        """
+        RETURN      one summary dictionary per (group, key, phase), sorted
+        """
+        rows = []
+        for (group, key, phase) in sorted(self.histograms, key=lambda item: (item[0], str(item[1]), PHASES.index(item[2]))):
+            rows.append({'group': group, 'key': key, 'phase': phase, **self.histograms[(group, key, phase)].summary()})
+        return rows
+
+    def export(self, file_name):
+        """
+        PURPOSE     saves the histograms, as a summary table for a .csv file or with every bucket for a .json file
+        PARAMETER   file_name: the .csv or .json file to write
+        """
+        if os.path.splitext(file_name)[1].lower() == '.json':
+            data = []
+            for row in self.rows():
+                histogram = self.histograms[(row['group'], row['key'], row['phase'])]
+                row['buckets'] = [[histogram.upper_edge(bucket), count] for bucket, count in
+                                  enumerate(histogram.counts) if count]
+                data.append(row)
+            with open(file_name, 'w') as file:
+                json.dump(data, file, indent=1)
+            return
+        with open(file_name, 'w', newline="") as csv_file:
+            writer = csv.DictWriter(csv_file, fieldnames=['group', 'key', 'phase', 'count', 'mean_s', 'min_s', 'p50_s',
+                                                          'p90_s', 'p99_s', 'max_s'])
+            writer.writeheader()
+            writer.writerows(self.rows())
+
+    def print_summary(self):
+        print(f"\n{'':<26}{'phase':<12}{'count':>7}{'mean (s)':>10}{'p50 (s)':>10}{'p90 (s)':>10}{'max (s)':>10}")
+        for row in self.rows():
+            if row['phase'] not in ('dosing', 'total'):
+                continue
+            print(f"{row['group'] + ' ' + str(row['key']):<26}{row['phase']:<12}{row['count']:>7}{row['mean_s']:>10.2f}"
+                  f"{row['p50_s']:>10.2f}{row['p90_s']:>10.2f}{row['max_s']:>10.2f}")
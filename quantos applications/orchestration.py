@@ -0,0 +1,158 @@
+"""
+runs the dispenses of a sweep on several Quantos units at the same time
+
+Author(s):      Ioana David
+Last modified:  Oct. 18th, 2026
+
+"""
+import collections
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class DosingScheduler:
+    """
+    PURPOSE     shares a queue of (target mass, trial) work between several instruments, one thread per instrument, so
+                the throughput grows with the number of instruments on the bench
+
+                a dispense that fails is retried on the same instrument; once an instrument runs out of retries it is
+                taken out of the sweep and its dispense goes back in the queue for the other instruments
+    """
+
+    def __init__(self, instruments, dispense, max_retries=2, retry_delay=5.0, timer=None):
+        """
+        PARAMETERS  instruments:    a dictionary of {name: instrument}, eg. {'10.0.0.1': Quantos(address='10.0.0.1')}
+                    dispense:       called as dispense(target_mass, instrument, timings), returns the quantity
+                                    dispensed (mg) and fills the timings dictionary with the time (s) of each phase
+                    max_retries:    the number of times a failed dispense is retried on the same instrument
+                    retry_delay:    the number of seconds to wait before retrying
+                    timer:          a DispenseTimer the phase timings are recorded in, or None
+        """
+        self.instruments = dict(instruments)
+        self.dispense = dispense
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.timer = timer
+        self.failed_instruments = {}        # name -> the error that took the instrument out of the sweep
+        self._lock = threading.Lock()
+
+    def run(self, work, on_result, refill=None):
+        """
+        PURPOSE     dispenses every item of work, spread over the instruments
+        PARAMETERS  work:       an iterable of (target mass, trial) pairs
+                    on_result:  called as on_result(instrument name, target mass, trial, quantity, timings) after each
+                                dispense; calls are made one at a time, so it can write to a log without its own locking
+                    refill:     None, or called as refill(in progress, instruments) whenever the queue runs dry, with
+                                the (target mass, trial) pairs being dispensed and the number of instruments still in
+                                the sweep; it returns the next items to queue, and the run ends once it returns none
+                                and nothing is left in progress. it is called between on_result calls, never during one
+        RETURN      a list of the (target mass, trial) pairs that could not be dispensed by any instrument
+        """
+        live = [name for name in self.instruments if name not in self.failed_instruments]
+        if len(live) == 0:
+            raise RuntimeError("no instruments left to dispense with")
+
+        def plan(in_progress):
+            with self._lock:
+                return list(refill(in_progress, sum(name not in self.failed_instruments for name in live)))
+
+        tasks = _WorkQueue(work, plan if refill is not None else None)
+        with ThreadPoolExecutor(max_workers=len(live), thread_name_prefix='quantos') as executor:
+            futures = [executor.submit(self._work, name, tasks, on_result) for name in live]
+            for future in futures:
+                future.result()     # re-raises an error from on_result
+        unfinished = tasks.remaining()
+        if unfinished:
+            print(f"{len(unfinished)} dispenses were not done, every instrument failed: {self.failed_instruments}")
+        return unfinished
+
+    def _work(self, name, tasks, on_result):
+        instrument = self.instruments[name]
+        while True:
+            item = tasks.get()
+            if item is None:
+                return
+            target_mass, trial = item
+            failed = False
+            try:
+                error = None
+                for attempt in range(self.max_retries + 1):
+                    timings = {}
+                    try:
+                        quantity = self.dispense(target_mass, instrument, timings)
+                    except Exception as dispense_error:
+                        error = dispense_error
+                        print(f"{name}: dispensing {target_mass} mg failed (attempt {attempt + 1}): {error}")
+                        if attempt < self.max_retries:
+                            time.sleep(self.retry_delay)
+                        continue
+                    with self._lock:
+                        if self.timer is not None:
+                            self.timer.record(name, target_mass, timings)
+                        on_result(name, target_mass, trial, quantity, timings)
+                    break
+                else:
+                    failed = True
+                    with self._lock:
+                        self.failed_instruments[name] = repr(error)
+                    print(f"{name}: taken out of the sweep after {self.max_retries + 1} failed attempts")
+            finally:
+                # a failed dispense goes back in the queue for another instrument, which is still waiting for it
+                tasks.done(item, requeue=failed)
+            if failed:
+                return
+
+
+class _WorkQueue:
+    """
+    PURPOSE     the (target mass, trial) items of a sweep, shared by the instrument threads
+
+                an instrument that finds the queue empty waits while another one is still dispensing, since that
+                dispense can fail and come back for it (or, with a refill, its result can call for more work); the
+                threads only stop once nothing is queued or in progress
+    """
+
+    def __init__(self, work, refill=None):
+        """
+        PARAMETERS  work:   an iterable of (target mass, trial) pairs
+                    refill: None, or called as refill(in progress) when the queue is empty, returning more items
+        """
+        self._items = collections.deque(work)
+        self._in_progress = []
+        self._refill = refill
+        self._condition = threading.Condition()
+
+    def get(self):
+        """
+        RETURN      the next item, or None once every item has been dispensed or given up on
+        """
+        with self._condition:
+            while True:
+                if not self._items and self._refill is not None:
+                    self._items.extend(self._refill(list(self._in_progress)))
+                if self._items:
+                    item = self._items.popleft()
+                    self._in_progress.append(item)
+                    return item
+                if not self._in_progress:
+                    return None
+                self._condition.wait()
+
+    def done(self, item, requeue=False):
+        """
+        PARAMETERS  item:       an item from get
+                    requeue:    True to put the item back for another instrument, when it could not be dispensed
+        """
+        with self._condition:
+            self._in_progress.remove(item)
+            if requeue:
+                self._items.append(item)
+            self._condition.notify_all()
+
+    def remaining(self):
+        """
+        RETURN      the items nobody dispensed, once every instrument thread has stopped
+        """
+        with self._condition:
+            return list(self._items)
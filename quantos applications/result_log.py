@@ -0,0 +1,155 @@
+"""
+an append-only JSON Lines log of the dispenses of a Quantos sweep, one record per dispense
+
+Author(s):      Ioana David
+Last modified:  Oct. 18th, 2026
+
+"""
+import json
+import os
+import time
+
+
+class ResultLog:
+    """
+    PURPOSE     appends one JSON record per dispense to a log file, so memory stays flat and a crash loses at most the
+                records written since the last fsync
+    """
+
+    def __init__(self, log_file_name, fsync_every=10, fsync_interval=5.0):
+        """
+        PARAMETERS  log_file_name:  the JSON Lines file, records are added to the end of it
+                    fsync_every:    the number of records after which the file is forced to disk
+                    fsync_interval: the number of seconds after which the file is forced to disk
+        """
+        self.log_file_name = log_file_name
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        _drop_partial_line(log_file_name)
+        self._file = open(log_file_name, 'a')
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def write(self, sweep, trial, target_mass, quantity, **extra):
+        """
+        PURPOSE     logs one dispense, O(1) no matter how many came before it
+        PARAMETERS  sweep:          the index of the sweep (each "run experiment again" is a new sweep)
+                    trial:          the index of the trial at this target mass
+                    target_mass:    the mass (mg) the Quantos was asked to dispense
+                    quantity:       the mass (mg) that was dispensed
+                    extra:          any other values to store with the record
+        RETURN      the record that was written
+        """
+        record = {
+            'sweep': sweep,
+            'target_mass': target_mass,
+            'trial': trial,
+            'quantity': quantity,
+            'percent_error': abs((quantity - target_mass) / target_mass),
+            'timestamp': time.time(),
+        }
+        record.update(extra)
+        self._file.write(json.dumps(record) + '\n')
+        self._unsynced += 1
+        if self._unsynced >= self.fsync_every or time.monotonic() - self._last_sync >= self.fsync_interval:
+            self.sync()
+        return record
+
+    def sync(self):
+        """
+        PURPOSE     forces the records written so far onto the disk
+        """
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def close(self):
+        self.sync()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def _drop_partial_line(log_file_name):
+    """
+    PURPOSE     cuts off a record that was only half written when the script stopped, so new records start on a new line
+    PARAMETER   the JSON Lines file written by ResultLog
+    """
+    if not os.path.exists(log_file_name) or os.path.getsize(log_file_name) == 0:
+        return
+    with open(log_file_name, 'rb+') as file:
+        file.seek(0, os.SEEK_END)
+        end = file.tell()
+        position = end
+        while position > 0:
+            step = min(4096, position)
+            file.seek(position - step)
+            chunk = file.read(step)
+            newline = chunk.rfind(b'\n')
+            if newline != -1:
+                position = position - step + newline + 1
+                break
+            position -= step
+        if position != end:
+            file.truncate(position)
+
+
+def read_result_log(log_file_name):
+    """
+    PURPOSE     reads the records of a log back, one at a time
+    PARAMETER   the JSON Lines file written by ResultLog
+    RETURN      a generator of the record dictionaries; a last line cut short by a crash is skipped
+    """
+    if not os.path.exists(log_file_name):
+        return
+    with open(log_file_name, 'r') as file:
+        for line in file:
+            if not line.endswith('\n'):
+                break           # the dispense was being written when the script stopped
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def completed_trials(log_file_name):
+    """
+    PURPOSE     finds what has already been dispensed, so an interrupted sweep can be resumed
+    PARAMETER   the JSON Lines file written by ResultLog
+    RETURN      the index of the last sweep (-1 if there are none) and a set of its (target mass, trial) pairs
+    """
+    last_sweep = -1
+    done = set()
+    for record in read_result_log(log_file_name):
+        if record['sweep'] > last_sweep:
+            last_sweep = record['sweep']
+            done = set()
+        done.add((record['target_mass'], record['trial']))
+    return last_sweep, done
+
+
+def summarize_results(log_file_name):
+    """
+    PURPOSE     rebuilds the per-mass summary of a log in one pass over it
+    PARAMETER   the JSON Lines file written by ResultLog
+    RETURN      a dictionary of {target mass: [quantity of each trial ..., average percent error]}, using the most
+                recent sweep that dispensed each mass, the same layout the script used to store in its JSON file
+    """
+    latest = {}         # target mass -> (sweep, {trial: record})
+    for record in read_result_log(log_file_name):
+        mass = record['target_mass']
+        sweep, trials = latest.get(mass, (None, None))
+        if sweep != record['sweep']:
+            trials = {}
+            latest[mass] = (record['sweep'], trials)
+        trials[record['trial']] = record
+    summary = {}
+    for mass, (sweep, trials) in latest.items():
+        records = [trials[trial] for trial in sorted(trials)]
+        avg_error = sum(record['percent_error'] for record in records) / len(records)
+        summary[mass] = [record['quantity'] for record in records] + [avg_error]
+    return summary
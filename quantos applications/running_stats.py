@@ -0,0 +1,209 @@
+"""
+running statistics of the dispenses of a Quantos sweep, updated in O(1) per dispense without keeping the trials
+
+Author(s):      Ioana David
+Last modified:  Oct. 18th, 2026
+
+"""
+import math
+from statistics import NormalDist
+
+# two-sided 95% critical values of Student's t distribution for 1 to 30 degrees of freedom
+T_95 = [12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228,
+        2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093, 2.086,
+        2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042]
+
+
+def t_critical(degrees_of_freedom, level=0.95):
+    """
+    PURPOSE     the critical value of Student's t distribution for a two-sided confidence interval
+    PARAMETERS  degrees_of_freedom: the number of trials minus one
+                level:              the confidence level
+    RETURN      the critical value; from the table for 95% and up to 30 degrees of freedom, otherwise from the
+                Cornish-Fisher expansion around the normal distribution
+    """
+    if level == 0.95 and degrees_of_freedom <= len(T_95):
+        return T_95[degrees_of_freedom - 1]
+    z = NormalDist().inv_cdf(0.5 + level / 2)
+    df = degrees_of_freedom
+    return z + (z ** 3 + z) / (4 * df) + (5 * z ** 5 + 16 * z ** 3 + 3 * z) / (96 * df ** 2)
+
+
+class P2Quantile:
+    """
+    PURPOSE     estimates one quantile of a stream with the P-squared algorithm (Jain & Chlamtac, 1985), keeping only
+                five markers instead of every value
+    """
+
+    def __init__(self, quantile):
+        self.quantile = quantile
+        self._heights = []
+        self._positions = [1, 2, 3, 4, 5]
+        self._desired = [1, 1 + 2 * quantile, 1 + 4 * quantile, 3 + 2 * quantile, 5]
+        self._increments = [0, quantile / 2, quantile, (1 + quantile) / 2, 1]
+
+    def update(self, value):
+        heights = self._heights
+        if len(heights) < 5:
+            heights.append(value)
+            heights.sort()
+            return
+        if value < heights[0]:
+            heights[0] = value
+            cell = 0
+        elif value >= heights[4]:
+            heights[4] = value
+            cell = 3
+        else:
+            cell = next(i for i in range(4) if heights[i] <= value < heights[i + 1])
+        for i in range(cell + 1, 5):
+            self._positions[i] += 1
+        for i in range(5):
+            self._desired[i] += self._increments[i]
+        # moves the three middle markers towards where they should be, with a parabolic (or linear) adjustment
+        for i in range(1, 4):
+            offset = self._desired[i] - self._positions[i]
+            if (offset >= 1 and self._positions[i + 1] - self._positions[i] > 1) or \
+                    (offset <= -1 and self._positions[i - 1] - self._positions[i] < -1):
+                step = 1 if offset > 0 else -1
+                height = self._parabolic(i, step)
+                if not heights[i - 1] < height < heights[i + 1]:
+                    height = heights[i] + step * (heights[i + step] - heights[i]) / \
+                        (self._positions[i + step] - self._positions[i])
+                heights[i] = height
+                self._positions[i] += step
+
+    def _parabolic(self, i, step):
+        n, q = self._positions, self._heights
+        return q[i] + step / (n[i + 1] - n[i - 1]) * (
+            (n[i] - n[i - 1] + step) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+            + (n[i + 1] - n[i] - step) * (q[i] - q[i - 1]) / (n[i] - n[i - 1]))
+
+    def value(self):
+        """
+        RETURN      the current estimate of the quantile (exact while there are five values or fewer)
+        """
+        heights = self._heights
+        if len(heights) == 0:
+            return math.nan
+        if len(heights) < 5:
+            index = self.quantile * (len(heights) - 1)
+            lower = int(math.floor(index))
+            upper = min(lower + 1, len(heights) - 1)
+            return heights[lower] + (heights[upper] - heights[lower]) * (index - lower)
+        return heights[2]
+
+
+class RunningStats:
+    """
+    PURPOSE     the count, mean and variance (Welford's method), minimum, maximum and a few quantiles of a stream of
+                values, each updated in O(1)
+    """
+
+    def __init__(self, quantiles=(0.05, 0.5, 0.95)):
+        self.count = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+        self.minimum = math.inf
+        self.maximum = -math.inf
+        self.quantiles = {quantile: P2Quantile(quantile) for quantile in quantiles}
+
+    def update(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (value - self.mean)
+        self.minimum = min(self.minimum, value)
+        self.maximum = max(self.maximum, value)
+        for estimator in self.quantiles.values():
+            estimator.update(value)
+
+    @property
+    def variance(self):
+        """
+        RETURN      the sample variance, NaN with fewer than two values
+        """
+        return self._m2 / (self.count - 1) if self.count > 1 else math.nan
+
+    @property
+    def std(self):
+        return math.sqrt(self.variance)
+
+    @property
+    def cv(self):
+        """
+        RETURN      the coefficient of variation (standard deviation / mean)
+        """
+        return self.std / abs(self.mean) if self.mean != 0 else math.nan
+
+    def confidence_interval(self, level=0.95):
+        """
+        RETURN      the half-width of the confidence interval on the mean, NaN with fewer than two values
+        """
+        if self.count < 2:
+            return math.nan
+        return t_critical(self.count - 1, level) * self.std / math.sqrt(self.count)
+
+    def quantile(self, quantile):
+        return self.quantiles[quantile].value()
+
+
+class SweepStatistics:
+    """
+    PURPOSE     keeps the running statistics of the dispensed quantity and the percent error for every target mass
+    """
+
+    def __init__(self):
+        self.quantity = {}
+        self.percent_error = {}
+
+    def update(self, target_mass, quantity):
+        """
+        PURPOSE     adds one dispense
+        PARAMETERS  target_mass:    the mass (mg) the Quantos was asked to dispense
+                    quantity:       the mass (mg) that was dispensed
+        RETURN      the summary of the target mass after the dispense
+        """
+        if target_mass not in self.quantity:
+            self.quantity[target_mass] = RunningStats()
+            self.percent_error[target_mass] = RunningStats()
+        self.quantity[target_mass].update(quantity)
+        self.percent_error[target_mass].update(abs((quantity - target_mass) / target_mass))
+        return self.summary(target_mass)
+
+    def trials(self, target_mass):
+        """
+        RETURN      the number of dispenses of a target mass so far
+        """
+        return self.quantity[target_mass].count if target_mass in self.quantity else 0
+
+    def summary(self, target_mass, level=0.95):
+        """
+        RETURN      a dictionary of the number of trials, the mean percent error with its confidence interval,
+                    minimum, maximum and 95th percentile, and the mean and coefficient of variation of the quantity
+        """
+        error = self.percent_error[target_mass]
+        quantity = self.quantity[target_mass]
+        return {
+            'target mass': target_mass,
+            'trials': error.count,
+            'mean error': error.mean,
+            'error ci': error.confidence_interval(level),
+            'min error': error.minimum,
+            'max error': error.maximum,
+            'p95 error': error.quantile(0.95),
+            'mean quantity': quantity.mean,
+            'cv': quantity.cv,
+        }
+
+    def summaries(self):
+        return [self.summary(target_mass) for target_mass in sorted(self.quantity)]
+
+
+def format_summary(summary):
+    """
+    RETURN      one line describing a summary from SweepStatistics
+    """
+    return (f"{summary['target mass']} mg: {summary['trials']} trials, mean error {summary['mean error']:.2%} "
+            f"± {summary['error ci']:.2%} (95% CI), max {summary['max error']:.2%}, "
+            f"mean {summary['mean quantity']:.3f} mg, CV {summary['cv']:.2%}")
@@ -0,0 +1,84 @@
+"""
+an offline stand-in for quantos.api.Quantos, so sweeps, logging, statistics and exports can be dry run without hardware
+
+Author(s):      Ioana David
+Last modified:  Oct. 18th, 2026
+
+"""
+import math
+import random
+import threading
+import time
+
+
+class SimulatedSampleData:
+    """
+    PURPOSE     the part of quantos.data.SampleData the scripts read: the quantity (mg) of the last dispense
+    """
+
+    def __init__(self, quantity):
+        self.quantity = quantity
+
+
+class SimulatedQuantos:
+    """
+    PURPOSE     dispenses the target mass with a configurable error model and dosing time, through the same
+                target_mass / start_dosing / sample_data interface as a Quantos
+
+                the dispensed quantity is target * (1 + bias) plus normal noise with a standard deviation of
+                sqrt((relative_noise * target) ** 2 + absolute_noise ** 2)
+    """
+
+    def __init__(self, address='simulated', bias=0.0, relative_noise=0.005, absolute_noise=0.02, dosing_time=20.0,
+                 dosing_time_per_mg=0.5, time_scale=0.0, failure_rate=0.0, seed=None):
+        """
+        PARAMETERS  address:            a name for the instrument, only used in its repr
+                    bias:               the systematic error of every dispense, as a fraction of the target mass
+                    relative_noise:     the standard deviation of the noise that grows with the target mass, as a fraction
+                    absolute_noise:     the standard deviation (mg) of the noise that does not depend on the target mass
+                    dosing_time:        the time (s) a dispense takes whatever its mass, as on the real instrument
+                    dosing_time_per_mg: the extra time (s) each mg of target mass adds to a dispense
+                    time_scale:         how much of the simulated time is actually slept, 1 for real time and 0 (the
+                                        default) to not sleep at all, so a large sweep runs in seconds
+                    failure_rate:       the chance of a dispense raising a RuntimeError, to exercise the retries
+                    seed:               the seed of the random numbers, for a reproducible dry run
+        """
+        self.address = address
+        self.bias = bias
+        self.relative_noise = relative_noise
+        self.absolute_noise = absolute_noise
+        self.dosing_time = dosing_time
+        self.dosing_time_per_mg = dosing_time_per_mg
+        self.time_scale = time_scale
+        self.failure_rate = failure_rate
+        self.target_mass = None
+        self.sample_data = None
+        self.dispenses = 0
+        self.simulated_time = 0.0       # the time (s) the dispenses would have taken on a real instrument
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self.address!r})'
+
+    def start_dosing(self, wait_for=True):
+        """
+        PURPOSE     dispenses the target mass; the quantity is in sample_data once dosing is done
+        PARAMETER   wait_for: kept for the same interface as Quantos, a simulated dispense always finishes before
+                    returning
+        """
+        if self.target_mass is None:
+            raise ValueError("set target_mass before dosing")
+        target_mass = float(self.target_mass)
+        with self._lock:
+            failed = self._random.random() < self.failure_rate
+            noise = self._random.gauss(0.0, math.hypot(self.relative_noise * target_mass, self.absolute_noise))
+        duration = self.dosing_time + self.dosing_time_per_mg * target_mass
+        if self.time_scale > 0:
+            time.sleep(duration * self.time_scale)
+        with self._lock:
+            self.simulated_time += duration
+            if failed:
+                raise RuntimeError(f"{self!r}: simulated dosing error")
+            self.dispenses += 1
+        self.sample_data = SimulatedSampleData(max(target_mass * (1 + self.bias) + noise, 0.0))